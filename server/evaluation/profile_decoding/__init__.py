@@ -0,0 +1,324 @@
+"""Payload decoder microbenchmarks
+
+Generates synthetic payloads for every point cloud encoding the service
+accepts, `payload_processors` of `service.payload` and the decoders of
+`NetworkTestingDataDecoder`, and measures how each decoder scales with
+the anchor size and the share of unobserved anchors. For every case the
+report holds
+
+- the decode time over `repeat` runs, in microseconds;
+- the number and size of memory blocks allocated by one decode that are
+  still held by its output, as traced by `tracemalloc`;
+- the peak traced memory of one decode, including temporaries.
+
+Reports are written as JSON, so results of two releases can be diffed,
+and `bench_decoders(baseline=...)` fails on decoders slower than the
+baseline report by more than `tolerance`.
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import platform
+import tracemalloc
+
+import numpy as np
+
+from utils3d import fibonacci_sphere
+from service import payload
+from service.api.network_testing import NetworkTestingDataDecoder
+
+
+def make_frame(anchors, sparsity, rng):
+    """Random observation of a fibonacci anchor sphere
+
+    A `sparsity` share of the anchors is left unobserved, i.e. has a
+    zero distance and color.
+    """
+    n = len(anchors)
+    index = np.sort(rng.choice(n, n - int(n * sparsity), replace=False))
+
+    distances = np.zeros((n), dtype=np.float32)
+    distances[index] = rng.uniform(0.5, 5, len(index))
+    colors = np.zeros((n, 3), dtype=np.float32)
+    colors[index] = rng.randint(0, 256, (len(index), 3)) / 255
+
+    return {
+        'index': index,
+        'anchors': anchors,
+        'distances': distances,
+        'colors': colors,
+        'xyz': anchors * distances[:, np.newaxis]
+    }
+
+
+def encode_column_major(f):
+    pc = np.concatenate((f['xyz'], f['colors']), axis=-1)
+    return pc.reshape((-1, 2, 3)).transpose((0, 2, 1)).astype('<f4').tobytes()
+
+
+def encode_row_major(f):
+    return np.concatenate((f['xyz'], f['colors']), axis=-1).astype('<f4').tobytes()
+
+
+def encode_float4(f):
+    pc = np.concatenate((f['colors'], f['distances'][:, np.newaxis]), axis=-1)
+    return pc.astype('<f4').tobytes()
+
+
+def encode_spherical_coordinate(f):
+    r = f['distances']
+    theta = np.arccos(np.clip(f['anchors'][:, 2], -1, 1))
+    phi = np.arctan2(f['anchors'][:, 1], f['anchors'][:, 0])
+    pc = np.concatenate((np.stack((r, theta, phi), axis=-1), f['colors']), axis=-1)
+
+    return pc.reshape((-1, 2, 3)).transpose((0, 2, 1)).astype('<f4').tobytes()
+
+
+def encode_xihe_optimized(f):
+    points = np.zeros(len(f['index']), dtype=payload.xihe_point_dtype)
+    points['index'] = f['index']
+    points['color'] = np.round(f['colors'][f['index']] * 255)
+    points['distance'] = f['distances'][f['index']]
+
+    return points.tobytes()
+
+
+def encode_naive_bytes(f):
+    return f['colors'].astype('<f4').tobytes()
+
+
+def encode_naive(f):
+    return base64.encodebytes(encode_naive_bytes(f)).decode()
+
+
+def encode_xihe(f):
+    idx = base64.encodebytes(f['index'].astype('<u2').tobytes()).decode()
+    clr = base64.encodebytes(f['colors'][f['index']].astype('<f4').tobytes()).decode()
+
+    return f'{idx},{clr}'
+
+
+def encode_xihe_bytes(f):
+    n = len(f['index'])
+    idx = f['index'].astype('<u2').tobytes()
+    clr = f['colors'][f['index']].astype('<f4').tobytes()
+
+    return n.to_bytes(2, byteorder='little') + idx + clr
+
+
+def encode_xihe_bytes_fast(f):
+    points = np.zeros(len(f['index']), dtype=[('index', '<u2'), ('color', '<f4', (3,))])
+    points['index'] = f['index']
+    points['color'] = f['colors'][f['index']]
+
+    return points.tobytes()
+
+
+def get_cases():
+    """Decoders to benchmark, with their payload encoder
+
+    Every case decodes a payload with `decode(data, anchors)`.
+    """
+    pp = payload.payload_processors
+    nt = NetworkTestingDataDecoder()
+    buffers = payload.DecodeBufferPool()
+
+    def pooled(data, anchors):
+        buf = buffers.acquire(len(anchors))
+        payload.handle_point_cloud_xihe_optimized_inplace(data, anchors, buf)
+        buffers.release(buf)
+
+    return {
+        'point_cloud_column_major': (
+            encode_column_major,
+            lambda data, anchors: pp['point_cloud_column_major'](data)),
+        'point_cloud_fib_sphere': (
+            encode_float4, pp['point_cloud_fib_sphere']),
+        'point_cloud_row_major': (
+            encode_row_major,
+            lambda data, anchors: pp['point_cloud_row_major'](data)),
+        'point_cloud_float4_no_stripe': (
+            encode_float4, pp['point_cloud_float4_no_stripe']),
+        'point_cloud_xihe_optimized': (
+            encode_xihe_optimized, pp['point_cloud_xihe_optimized']),
+        'point_cloud_xihe_optimized_inplace': (
+            encode_xihe_optimized,
+            payload.handle_point_cloud_xihe_optimized_inplace),
+        'point_cloud_xihe_optimized_pooled': (
+            encode_xihe_optimized, pooled),
+        'point_cloud_spherical_coordinate': (
+            encode_spherical_coordinate,
+            lambda data, anchors: pp['point_cloud_spherical_coordinate'](data)),
+        'network_testing_naive': (
+            encode_naive, lambda data, anchors: nt.naive_decode(data)),
+        'network_testing_naive_bytes': (
+            encode_naive_bytes, lambda data, anchors: nt.naive_bytes_decode(data)),
+        'network_testing_xihe': (
+            encode_xihe, lambda data, anchors: nt.xihe_decode(data, len(anchors))),
+        'network_testing_xihe_bytes': (
+            encode_xihe_bytes,
+            lambda data, anchors: nt.xihe_bytes_decode(data, len(anchors))),
+        'network_testing_xihe_bytes_fast': (
+            encode_xihe_bytes_fast,
+            lambda data, anchors: nt.xihe_bytes_decode_fast(data, len(anchors)))
+    }
+
+
+def measure_time(decode, data, anchors, repeat):
+    decode(data, anchors)
+
+    t = np.zeros((repeat), dtype=np.float64)
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        decode(data, anchors)
+        t[i] = time.perf_counter() - t0
+
+    t *= 1e6
+
+    return {
+        'mean_us': float(t.mean()),
+        'p50_us': float(np.percentile(t, 50)),
+        'p99_us': float(np.percentile(t, 99)),
+        'min_us': float(t.min())
+    }
+
+
+def measure_memory(decode, data, anchors):
+    # Restarting clears traces and the peak, tracemalloc.reset_peak
+    # needs Python 3.9
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    tracemalloc.start()
+
+    base, _ = tracemalloc.get_traced_memory()
+
+    out = decode(data, anchors)
+
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(ignore).statistics('lineno')
+    del out
+
+    return {
+        'allocations': sum(v.count for v in stats),
+        'allocated_bytes': sum(v.size for v in stats),
+        'peak_bytes': peak - base
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Cases slower than the baseline by more than `tolerance`"""
+    reference = {
+        (v['decoder'], v['anchor_size'], v['sparsity']): v
+        for v in baseline['results']}
+
+    regressions = []
+    for v in results:
+        ref = reference.get((v['decoder'], v['anchor_size'], v['sparsity']))
+        if ref is None:
+            continue
+
+        ratio = v['time']['p50_us'] / max(ref['time']['p50_us'], 1e-9)
+        if ratio > 1 + tolerance:
+            regressions.append({
+                'decoder': v['decoder'],
+                'anchor_size': v['anchor_size'],
+                'sparsity': v['sparsity'],
+                'p50_us': v['time']['p50_us'],
+                'baseline_p50_us': ref['time']['p50_us'],
+                'ratio': ratio
+            })
+
+    return regressions
+
+
+def bench_decoders(output='./dist/profile_decoding/decoders.json',
+                   anchor_sizes=(512, 768, 1024, 1280, 2048),
+                   sparsity=(0, 0.5, 0.9), decoders=None, repeat=200,
+                   seed=0, baseline=None, tolerance=0.2):
+    """Benchmark all payload decoders and write a JSON report
+
+    Parameters
+    ----------
+    output : str
+        Path of the JSON report
+    anchor_sizes : list
+        Anchor sizes to generate payloads for
+    sparsity : list
+        Shares of unobserved anchors to generate payloads for
+    decoders : list
+        Names of the decoders to run, None for all
+    repeat : int
+        Timed decodes per case
+    seed : int
+        Seed of the synthetic payloads
+    baseline : str
+        Path of an earlier report to check for regressions
+    tolerance : float
+        Allowed relative slowdown of the median decode time
+    """
+    if isinstance(anchor_sizes, int):
+        anchor_sizes = [anchor_sizes]
+    if isinstance(sparsity, (int, float)):
+        sparsity = [sparsity]
+
+    cases = get_cases()
+    if decoders is not None:
+        decoders = [decoders] if isinstance(decoders, str) else decoders
+        cases = {k: cases[k] for k in decoders}
+
+    rng = np.random.RandomState(seed)
+    results = []
+
+    for anchor_size in anchor_sizes:
+        anchors = np.array(fibonacci_sphere(anchor_size), dtype=np.float32)
+
+        for s in sparsity:
+            frame = make_frame(anchors, s, rng)
+
+            for name, (encode, decode) in cases.items():
+                data = encode(frame)
+
+                results.append({
+                    'decoder': name,
+                    'anchor_size': anchor_size,
+                    'sparsity': s,
+                    'payload_bytes': len(data),
+                    'time': measure_time(decode, data, anchors, repeat),
+                    'memory': measure_memory(decode, data, anchors)
+                })
+
+                print(f'{name:40s} {anchor_size:5d} {s:4.2f} '
+                      f'{results[-1]["time"]["p50_us"]:10.1f} us')
+
+    report = {
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': results
+    }
+
+    if baseline is not None:
+        with open(baseline, 'r') as f:
+            report['regressions'] = compare(results, json.load(f), tolerance)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'Report saved to {output}')
+
+    if baseline is not None and len(report['regressions']) > 0:
+        for v in report['regressions']:
+            print(f'Regression: {v["decoder"]} at {v["anchor_size"]} anchors, '
+                  f'sparsity {v["sparsity"]}: {v["ratio"]:.2f}x baseline')
+        sys.exit(1)
@@ -0,0 +1,278 @@
+"""Concurrent load testing of the lighting estimation service
+
+A reference client encodes synthetic point clouds exactly as the
+`point_cloud_xihe_optimized` decoder of `service.payload` expects them,
+registers many sessions through `/api/v2/session/` and drives
+`/api/v2/lighting-estimation/` of every session at a fixed frame rate.
+Frames are sent on schedule whether or not earlier frames have been
+answered, up to `max_in_flight` per session, so an overloaded server
+shows up as growing latency and skipped frames rather than as a slower
+client. Run it against a local `./launch.py serve` instance:
+
+    ./launch.py load_test --sessions=32 --fps=30 --duration=30
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import platform
+import collections
+
+import numpy as np
+import tornado.httpclient
+
+from utils3d import fibonacci_sphere
+from service.payload import xihe_point_dtype
+
+
+def encode_point_cloud_xihe_optimized(xyz, rgb, anchors):
+    """Reference client encoder of point_cloud_xihe_optimized payloads
+
+    Every point is assigned to the anchor closest to its direction, and
+    each observed anchor keeps its nearest point.
+
+    Input:
+        xyz: point positions relative to the probe, [M, 3]
+        rgb: point colors in [0, 1], [M, 3]
+        anchors: fibonacci sphere anchors, [N, 3]
+    Return:
+        payload: packed (index, color, distance) points, bytes
+    """
+    distance = np.linalg.norm(xyz, axis=-1)
+    valid = distance > 0
+    xyz, rgb, distance = xyz[valid], rgb[valid], distance[valid]
+
+    index = np.argmax((xyz / distance[:, np.newaxis]) @ anchors.T, axis=-1)
+
+    # nearest point per anchor: sort by distance, keep first occurrences
+    order = np.lexsort((distance, index))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = index[order][1:] != index[order][:-1]
+    keep = order[first]
+
+    points = np.zeros(len(keep), dtype=xihe_point_dtype)
+    points['index'] = index[keep]
+    points['color'] = np.clip(np.round(rgb[keep] * 255), 0, 255)
+    points['distance'] = distance[keep]
+
+    return points.tobytes()
+
+
+class SyntheticScene:
+    """Random colored scene around a probe, drifting slowly per frame"""
+
+    def __init__(self, anchor_size, n_points, rng):
+        self.anchors = np.array(fibonacci_sphere(anchor_size), dtype=np.float32)
+        self.rng = rng
+
+        directions = rng.normal(size=(n_points, 3))
+        directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+
+        self.xyz = directions * rng.uniform(0.5, 5, (n_points, 1))
+        self.rgb = rng.uniform(0, 1, (n_points, 3))
+
+    def next_frame(self, drift=0.01, observed=0.6):
+        self.xyz += self.rng.normal(scale=drift, size=self.xyz.shape)
+        self.rgb = np.clip(
+            self.rgb + self.rng.normal(scale=drift, size=self.rgb.shape), 0, 1)
+
+        mask = self.rng.uniform(size=len(self.xyz)) < observed
+
+        return encode_point_cloud_xihe_optimized(
+            self.xyz[mask], self.rgb[mask], self.anchors)
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = collections.Counter()
+        self.n_sent = 0
+        self.n_skipped = 0
+
+    def report(self, duration):
+        latencies = np.array(self.latencies, dtype=np.float64) * 1000
+        n_errors = sum(self.errors.values())
+        n_done = len(latencies) + n_errors
+
+        if len(latencies) == 0:
+            latencies = np.zeros((1), dtype=np.float64)
+
+        return {
+            'n_sent': self.n_sent,
+            'n_ok': len(self.latencies),
+            'n_errors': n_errors,
+            'n_skipped': self.n_skipped,
+            'errors': dict(self.errors),
+            'error_rate': n_errors / n_done if n_done else 0,
+            'throughput': len(self.latencies) / duration,
+            'latency_ms': {
+                'mean': float(latencies.mean()),
+                'p50': float(np.percentile(latencies, 50)),
+                'p95': float(np.percentile(latencies, 95)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': float(latencies.max())
+            }
+        }
+
+
+async def register_session(client, url, anchor_size):
+    r = await client.fetch(
+        f'{url}/api/v2/session/', method='POST', body=b'',
+        headers={'Anchor-Size': str(anchor_size)})
+
+    return json.loads(r.body)['sid']
+
+
+async def send_frame(client, url, sid, payload, stats, in_flight):
+    t0 = time.perf_counter()
+    try:
+        r = await client.fetch(
+            f'{url}/api/v2/lighting-estimation/', method='POST', body=payload,
+            headers={'Session-ID': sid}, raise_error=False)
+        if r.code == 200:
+            stats.latencies.append(time.perf_counter() - t0)
+        else:
+            stats.errors[str(r.code)] += 1
+    except Exception as e:
+        stats.errors[type(e).__name__] += 1
+    finally:
+        in_flight[sid] -= 1
+
+
+async def run_session(client, url, anchor_size, frames, fps, deadline, stats,
+                      max_in_flight):
+    sid = await register_session(client, url, anchor_size)
+    in_flight = collections.Counter()
+    tasks = []
+
+    t_next = time.perf_counter()
+    i = 0
+    while t_next < deadline:
+        await asyncio.sleep(max(0, t_next - time.perf_counter()))
+        t_next += 1 / fps
+
+        if in_flight[sid] >= max_in_flight:
+            stats.n_skipped += 1
+            continue
+
+        in_flight[sid] += 1
+        stats.n_sent += 1
+        tasks.append(asyncio.ensure_future(send_frame(
+            client, url, sid, frames[i % len(frames)], stats, in_flight)))
+        i += 1
+
+    await asyncio.gather(*tasks)
+
+
+async def run_load(url, sessions, fps, duration, anchor_size, n_points,
+                   n_frames, max_in_flight, ramp_up, seed):
+    client = tornado.httpclient.AsyncHTTPClient(
+        force_instance=True, max_clients=sessions * max_in_flight + 16)
+    rng = np.random.RandomState(seed)
+    stats = LoadStats()
+
+    # frames are encoded upfront so encoding does not skew the schedule
+    frames = []
+    for _ in range(sessions):
+        scene = SyntheticScene(anchor_size, n_points, rng)
+        frames.append([scene.next_frame() for _ in range(n_frames)])
+
+    t_start = time.perf_counter()
+    deadline = t_start + ramp_up + duration
+
+    async def delayed(i):
+        await asyncio.sleep(ramp_up * i / sessions)
+        try:
+            await run_session(
+                client, url, anchor_size, frames[i], fps, deadline, stats,
+                max_in_flight)
+        except Exception as e:
+            stats.errors[f'session_{type(e).__name__}'] += 1
+
+    await asyncio.gather(*[delayed(i) for i in range(sessions)])
+    client.close()
+
+    return stats.report(time.perf_counter() - t_start - ramp_up / 2)
+
+
+def load_test(url='http://localhost:8550', sessions=16, fps=30, duration=30,
+              anchor_size=1280, n_points=20000, n_frames=16, max_in_flight=4,
+              ramp_up=2,
+              seed=0, output='./dist/profile_load/load.json',
+              min_throughput=None, max_p99_ms=None, max_error_rate=None):
+    """Drive a running service with concurrent AR sessions
+
+    Parameters
+    ----------
+    url : str
+        Base URL of the service
+    sessions : int
+        Number of concurrent sessions
+    fps : float
+        Lighting estimation requests per second and session
+    duration : float
+        Seconds to run after ramping up
+    anchor_size : int
+        Anchor size of every session
+    n_points : int
+        Points of the synthetic scene of each session
+    n_frames : int
+        Distinct frames per session, sent in a loop
+    max_in_flight : int
+        Unanswered requests per session above which frames are skipped
+    ramp_up : float
+        Seconds over which sessions are started
+    seed : int
+        Seed of the synthetic scenes
+    output : str
+        Path of the JSON report
+    min_throughput : float
+        Fail if fewer requests per second are answered
+    max_p99_ms : float
+        Fail if the p99 latency is higher
+    max_error_rate : float
+        Fail if a larger share of requests fails
+    """
+    report = asyncio.run(run_load(
+        url, sessions, fps, duration, anchor_size, n_points, n_frames,
+        max_in_flight, ramp_up, seed))
+
+    report = {
+        'url': url,
+        'sessions': sessions,
+        'fps': fps,
+        'offered_load': sessions * fps,
+        'duration': duration,
+        'anchor_size': anchor_size,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        **report
+    }
+
+    failures = []
+    if min_throughput is not None and report['throughput'] < min_throughput:
+        failures.append(f'throughput {report["throughput"]:.1f} < {min_throughput}')
+    if max_p99_ms is not None and report['latency_ms']['p99'] > max_p99_ms:
+        failures.append(f'p99 {report["latency_ms"]["p99"]:.1f} ms > {max_p99_ms}')
+    if max_error_rate is not None and report['error_rate'] > max_error_rate:
+        failures.append(f'error rate {report["error_rate"]:.3f} > {max_error_rate}')
+    report['failures'] = failures
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    latency = report['latency_ms']
+    print(f'{sessions} sessions at {fps} fps: '
+          f'{report["throughput"]:.1f} req/s, '
+          f'p50 {latency["p50"]:.1f} ms, p95 {latency["p95"]:.1f} ms, '
+          f'p99 {latency["p99"]:.1f} ms, error rate {report["error_rate"]:.3f}, '
+          f'{report["n_skipped"]} frames skipped')
+    print(f'Report saved to {output}')
+
+    for v in failures:
+        print(f'Capacity regression: {v}')
+    if len(failures) > 0:
+        sys.exit(1)
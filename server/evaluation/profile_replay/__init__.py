@@ -0,0 +1,265 @@
+"""Offline replay of recorded AR sessions through the server pipeline
+
+Recorded frames are encoded as `point_cloud_xihe_optimized` payloads and
+fed, in-process and without HTTP, through `estimate_lighting_into`, the
+decode, trigger, inference and filtering pipeline of the server, one
+frame at a time and without batching. Every frame records its stage spans and whether it was inferred,
+answered from the trigger cache or by the filter, so server logic can be
+profiled on real data deterministically:
+
+    ./launch.py replay_session ./dist/xihe_service/rgbd_ar_session/<sid>.npy
+
+Supported recordings are
+- `.npy` RGBD AR sessions, [F, 256 * 192, 6] xyz and rgb points, which
+  are projected onto the anchors around `probe`;
+- dump containers of point clouds, given as a `.xrec` part or as
+  `<root>/<sid>_<type>` for all parts. Anchor point clouds recorded at
+  `anchor_size` are re-encoded exactly, others are projected as above.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import platform
+
+import numpy as np
+
+from service.container import read_records
+from service.container import container_parts
+from service.payload import xihe_point_dtype
+from service.utils import anchor_pool
+from service.engine import engine
+from service.trigger import trigger as change_trigger
+from service.filtering import sh_filter as temporal_filter
+from service.tracing import Spans
+from service.api.lighting_estimation import estimate_lighting_into
+from service.api.lighting_estimation import decode_buffers
+from evaluation.profile_load import encode_point_cloud_xihe_optimized
+
+
+stages = ('decode', 'trigger', 'stage', 'forward', 'postprocess')
+
+
+def encode_anchor_points(pc):
+    """Encode a decoded [N, 6] anchor point cloud as its original payload"""
+    distance = np.linalg.norm(pc[:, :3], axis=-1)
+    index = np.flatnonzero(distance > 0)
+
+    points = np.zeros(len(index), dtype=xihe_point_dtype)
+    points['index'] = index
+    points['color'] = np.clip(np.round(pc[index, 3:] * 255), 0, 255)
+    points['distance'] = distance[index]
+
+    return points.tobytes()
+
+
+def project_points(xyz, rgb, anchors, probe):
+    rgb = np.asarray(rgb, dtype=np.float32)
+    if rgb.max() > 1:
+        rgb = rgb / 255
+
+    return encode_point_cloud_xihe_optimized(
+        np.asarray(xyz, dtype=np.float32) - probe, rgb, anchors)
+
+
+def load_ar_session(path, anchors, probe):
+    frames = np.load(path, mmap_mode='r')
+
+    for i, frame in enumerate(frames):
+        # frames are zero-padded where the depth map had no points
+        frame = frame[np.any(frame[:, :3] != 0, axis=-1)]
+        yield {'frame': i}, project_points(
+            frame[:, :3], frame[:, 3:], anchors, probe)
+
+
+def load_dump_container(paths, anchors, probe):
+    i = 0
+    for path in paths:
+        for meta, arrays in read_records(path):
+            if 'point_cloud' not in meta['type']:
+                continue
+
+            pc = np.zeros((meta['n_points'], 6), dtype=np.float32)
+            pc[arrays['index']] = arrays['points']
+
+            if meta.get('anchor_size') == len(anchors):
+                payload = encode_anchor_points(pc)
+            else:
+                pc = pc[np.any(pc[:, :3] != 0, axis=-1)]
+                payload = project_points(pc[:, :3], pc[:, 3:], anchors, probe)
+
+            yield {'frame': i, 'time': meta['time']}, payload
+            i += 1
+
+
+def load_frames(path, anchors, probe=(0, 0, 0)):
+    """Yield `(meta, payload)` of every frame of a recorded session"""
+    probe = np.array(probe, dtype=np.float32)
+
+    if path.endswith('.npy'):
+        return load_ar_session(path, anchors, probe)
+
+    if path.endswith('.xrec'):
+        return load_dump_container([path], anchors, probe)
+
+    paths = container_parts(os.path.dirname(path), os.path.basename(path))
+    if len(paths) == 0:
+        raise FileNotFoundError(f'No recording found at {path}')
+
+    return load_dump_container(paths, anchors, probe)
+
+
+async def infer(xyz, rgb, spans):
+    """Run a single point cloud on the engine, without batching"""
+    return engine.infer(xyz, rgb, spans)
+
+
+async def replay_frames(session, frames, fps, filter_mode, buf):
+    """Feed `(meta, payload)` frames through the server pipeline
+
+    Return:
+        frames: per-frame report entries
+        coefficients: SH coefficients answered for every frame, [F, 27]
+    """
+    entries = []
+    coefficients = []
+
+    for meta, payload in frames:
+        # the filter sees the recording's frame times instead of wall time
+        now = meta['frame'] / fps
+        temporal_filter.clock = lambda: now
+        spans = Spans()
+
+        c, source = await estimate_lighting_into(
+            session, payload, filter_mode, buf, spans, infer)
+        durations = spans.durations()
+
+        coefficients.append(c)
+        entries.append({
+            **meta,
+            'source': source,
+            'n_observed': len(payload) // xihe_point_dtype.itemsize,
+            'stages_ms': {k: v * 1000 for k, v in durations.items()},
+            'total_ms': sum(durations.values()) * 1000
+        })
+
+    return entries, coefficients
+
+
+def summarize(values):
+    values = np.array(values, dtype=np.float64) * 1000
+    if len(values) == 0:
+        return None
+
+    return {
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'max': float(values.max())
+    }
+
+
+def replay_session(path, anchor_size=1280, checkpoint='./model/model.ckpt',
+                   device='cpu', fps=30, trigger=True,
+                   trigger_threshold=0.02, trigger_max_skips=30,
+                   sh_filter='none', probe=(0, 0, 0), warmup=3,
+                   output=None):
+    """Replay a recorded session through the lighting estimation pipeline
+
+    Parameters
+    ----------
+    path : str
+        `.npy` RGBD AR session, `.xrec` container part or container name
+    anchor_size : int
+        Anchor size of the replayed session
+    checkpoint : str
+        Path to the XiheNet checkpoint
+    device : str
+        Torch device to run on
+    fps : float
+        Frame rate of the recording, clocks the temporal filter
+    trigger : bool
+        Skip frames whose point cloud barely changed
+    trigger_threshold : float
+        Change threshold of the trigger
+    trigger_max_skips : int
+        Maximum number of consecutive skipped frames
+    sh_filter : str
+        Temporal SH filter, 'none', 'ema' or 'kalman'
+    probe : tuple
+        Probe position the recorded points are projected around
+    warmup : int
+        Forward passes run before replaying, excluded from the report
+    output : str
+        Path of the JSON report, named after the recording by default.
+        The answered coefficients are saved alongside as `.npy`
+    """
+    if output is None:
+        name = os.path.basename(path).split('.')[0]
+        output = f'./dist/profile_replay/{name}.json'
+
+    engine.checkpoint = checkpoint
+    engine.configure(
+        device=device, warmup_anchor_sizes=[anchor_size],
+        warmup_batch_sizes=[1])
+    engine.warmup_repeat = warmup
+    engine.load()
+
+    change_trigger.configure(
+        enabled=trigger,
+        threshold=trigger_threshold,
+        max_skips=trigger_max_skips)
+    temporal_filter.configure(mode=sh_filter)
+
+    anchors = anchor_pool[anchor_size]
+
+    session = {'anchors': anchors}
+    buf = decode_buffers.acquire(anchor_size)
+
+    try:
+        frames, coefficients = asyncio.run(replay_frames(
+            session, load_frames(path, anchors, probe), fps,
+            temporal_filter.mode, buf))
+    finally:
+        decode_buffers.release(buf)
+        temporal_filter.clock = time.monotonic
+
+    if len(frames) == 0:
+        print(f'No point cloud frames in {path}')
+        return
+
+    sources = [v['source'] for v in frames]
+    report = {
+        'recording': path,
+        'anchor_size': anchor_size,
+        'device': str(engine.device),
+        'trigger': trigger,
+        'sh_filter': temporal_filter.mode,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'n_frames': len(frames),
+        'n_inferred': sources.count('inferred'),
+        'n_skipped': len(frames) - sources.count('inferred'),
+        'skip_rate': 1 - sources.count('inferred') / len(frames),
+        'stages_ms': {
+            k: summarize([v['stages_ms'][k] / 1000 for v in frames
+                          if k in v['stages_ms']])
+            for k in stages
+        },
+        'total_ms': summarize([v['total_ms'] / 1000 for v in frames]),
+        'frames': frames
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    np.save(os.path.splitext(output)[0] + '.npy', np.stack(coefficients))
+
+    for k, v in report['stages_ms'].items():
+        if v is not None:
+            print(f'{k:12s} mean {v["mean"]:8.3f} ms, p95 {v["p95"]:8.3f} ms')
+    print(f'{report["n_frames"]} frames, {report["n_inferred"]} inferred, '
+          f'skip rate {report["skip_rate"]:.2f}')
+    print(f'Report saved to {output}')
@@ -59,3 +59,54 @@ def merge_rec(recording_file):
     os.system(
         f'ffmpeg -framerate 30 -i ./dist/recording/{rec_name}/frames/%d_depth.png ' +
         f'-c:v libx264 ./evaluation/real_world_testing/recordings/{rec_name}_depth.mp4')
+
+
+def export_rec(archive, output=None, video=False):
+    """Export a recording archive of the service to PNG frames
+
+    Parameters
+    ----------
+    archive : str
+        Archive directory, e.g. ./dist/recording/2022/01/01/12_00_00
+    output : str
+        Directory of the exported frames, `<archive>/frames` by default
+    video : bool
+        Also encode the frames into color and depth videos with ffmpeg
+    """
+    from service.container import read_records, container_parts
+
+    output = output or os.path.join(archive, 'frames')
+    os.makedirs(output, exist_ok=True)
+
+    parts = container_parts(archive, 'frames')
+    if len(parts) == 0:
+        print(f'No recorded frames found in {archive}')
+        return
+
+    print('Exporting color frames')
+    depth_min, depth_max = np.inf, -np.inf
+    for p in parts:
+        for meta, arrays in tqdm(read_records(p)):
+            if meta['type'] == 'rgb':
+                imageio.imsave(
+                    f'{output}/{meta["frame"]}_color.png', arrays['data'])
+            elif meta['type'] == 'depth':
+                depth_min = min(depth_min, np.min(arrays['data']))
+                depth_max = max(depth_max, np.max(arrays['data']))
+
+    # Depth is normalized over the whole recording, as in merge_rec
+    print('Saving normalized depth images')
+    for p in parts:
+        for meta, arrays in tqdm(read_records(p)):
+            if meta['type'] != 'depth':
+                continue
+
+            data = (arrays['data'] - depth_min) / depth_max * np.iinfo(np.uint16).max
+            imageio.imsave(
+                f'{output}/{meta["frame"]}_depth.png', data.astype(np.uint16))
+
+    if video:
+        for t in ('color', 'depth'):
+            os.system(
+                f'ffmpeg -framerate 30 -i {output}/%d_{t}.png ' +
+                f'-c:v libx264 {output}/{t}.mp4')
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import math
+import torch
 import PIL.Image
 import numpy as np
 
+from utils3d import fibonacci_sphere
+
 
 class JointPercentageCalculator:
     def __init__(self, anchor_levels, to_cuda=True):
@@ -13,7 +13,12 @@ entries = {
     'post_message': {'module': 'model.utils', 'func': 'post_message'},
     'train': {'module': 'model', 'func': 'train_xihenet'},
     'serve': {'module': 'service', 'func': 'start_service'},
+    'export_model': {'module': 'service.engine', 'func': 'export_model'},
     'merge_rec': {'module': 'evaluation.real_world_testing', 'func': 'merge_rec'},
+    'export_rec': {'module': 'evaluation.real_world_testing', 'func': 'export_rec'},
+    'bench_decoders': {'module': 'evaluation.profile_decoding', 'func': 'bench_decoders'},
+    'load_test': {'module': 'evaluation.profile_load', 'func': 'load_test'},
+    'replay_session': {'module': 'evaluation.profile_replay', 'func': 'replay_session'},
 }
 
 
@@ -35,7 +35,10 @@ def train_xihenet(debug=False,
                   dataset='xihe',
                   n_points=1280,
                   num_workers=16,
-                  batch_size=32):
+                  batch_size=32,
+                  fps_shortcut=True,
+                  neighbourhood_chunk=0,
+                  knn_density=False):
     """Train XiheNet model
 
     Parameters
@@ -52,6 +55,15 @@ def train_xihenet(debug=False,
         Number of workers for loading data, default 16
     batch_size : int
         Training batch size
+    fps_shortcut : bool
+        Take every point instead of farthest point sampling in layers
+        sampling all input points; changes the model and is recorded in
+        the checkpoint hparams
+    neighbourhood_chunk : int
+        Tile size of the pairwise distances for densities and kNN
+        grouping, bounds memory for large inputs, 0 for full matrices
+    knn_density : bool
+        Estimate point densities from the kNN neighbourhood only
     """
 
     EXP_NAME = datetime.now().strftime('%Y/%m/%d/%H_%M_%S')
@@ -69,6 +81,9 @@ def train_xihenet(debug=False,
         'loss': loss,
         'dataset': dataset,
         'use_traind10': use_traind10,
+        'fps_shortcut': fps_shortcut,
+        'neighbourhood_chunk': neighbourhood_chunk,
+        'knn_density': knn_density,
         'CUDA_VISIBLE_DEVICES': num_gpu
     }
 
@@ -123,6 +138,9 @@ def train_xihenet(debug=False,
         'n_shc': 27,
         'n_points': n_points,
         'loss': loss,
+        'fps_shortcut': fps_shortcut,
+        'neighbourhood_chunk': neighbourhood_chunk,
+        'knn_density': knn_density,
         'min': torch.from_numpy(scaler.min_) if normalize else torch.zeros((27)),
         'scale': torch.from_numpy(scaler.scale_) if normalize else torch.ones((27))
     })
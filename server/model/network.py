@@ -17,14 +17,27 @@ class PointConvModel(pl.LightningModule):
 
         n_points = int(self.hparams['n_points'])
 
+        # sa1 samples all n_points once instead of running FPS, which
+        # repeats coinciding points such as unobserved anchors at the
+        # origin; this changes the model, checkpoints without the flag
+        # keep running FPS
+        fps_shortcut = bool(self.hparams.get('fps_shortcut', False))
+
+        # tiled neighbourhood computation bounds memory for large inputs,
+        # kNN-restricted densities change the model and need training
+        chunk = int(self.hparams.get('neighbourhood_chunk', 0))
+        knn_density = bool(self.hparams.get('knn_density', False))
+
         self.sa1 = PointConvDensitySetAbstraction(
             npoint=n_points, nsample=32, in_channel=3 + 3,
-            mlp=[64, 128], bandwidth=0.1, group_all=False
+            mlp=[64, 128], bandwidth=0.1, group_all=False,
+            fps_shortcut=fps_shortcut, chunk=chunk, knn_density=knn_density
         )
 
         self.sa2 = PointConvDensitySetAbstraction(
             npoint=1, nsample=0, in_channel=128 + 3,
-            mlp=[128, 256], bandwidth=0.2, group_all=True
+            mlp=[128, 256], bandwidth=0.2, group_all=True,
+            chunk=chunk
         )
 
         self.fc3 = nn.Linear(256, 128)
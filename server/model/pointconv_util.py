@@ -7,7 +7,12 @@ Date: September 2019
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch_cluster import fps
+from typing import Optional
+
+try:
+    from torch_cluster import fps
+except ImportError:
+    fps = None
 
 
 def square_distance(src, dst):
@@ -106,8 +111,70 @@ def farthest_point_sample_fast(xyz, npoint: int):
     return centroids
 
 
-# farthest_point_sample_original
-farthest_point_sample = farthest_point_sample_fast
+def farthest_point_sample_cluster(xyz, npoint: int):
+    """
+    FPS of the whole batch with a single torch_cluster call, starting
+    from the first point of every sample like the original
+
+    Input:
+        xyz: pointcloud data, [B, N, C]
+        npoint: number of samples
+    Return:
+        centroids: sampled pointcloud index, [B, npoint]
+    """
+    device = xyz.device
+    B, N, C = xyz.shape
+
+    samples = torch.arange(B, dtype=torch.long, device=device).view(B, 1)
+    batch = samples.repeat(1, N).view(-1)
+
+    r = npoint / N * 0.9999999 + 0.00000001
+
+    centroids = fps(
+        xyz.reshape(B * N, C), batch, ratio=r, random_start=False)
+    centroids = centroids.view(B, npoint) - samples * N
+
+    return centroids
+
+
+def farthest_point_sample_batched(xyz, npoint: int):
+    """
+    FPS of the whole batch in plain torch, for CPU and GPU without
+    torch_cluster. Samples the same points as the original, keeping
+    the running distances with torch.minimum instead of masked
+    assignment; the iterations over npoint are inherent to FPS.
+
+    Input:
+        xyz: pointcloud data, [B, N, C]
+        npoint: number of samples
+    Return:
+        centroids: sampled pointcloud index, [B, npoint]
+    """
+    device = xyz.device
+    B, N, C = xyz.shape
+
+    centroids = torch.zeros(B, npoint, dtype=torch.long, device=device)
+    distance = torch.full((B, N), 1e10, dtype=xyz.dtype, device=device)
+    farthest = torch.zeros(B, dtype=torch.long, device=device)
+
+    # flat offsets of every sample, gathers centroids without fancy indexing
+    offsets = torch.arange(B, dtype=torch.long, device=device) * N
+    xyz_flat = xyz.reshape(B * N, C)
+
+    for i in range(npoint):
+        centroids[:, i] = farthest
+        centroid = xyz_flat.index_select(0, farthest + offsets).view(B, 1, C)
+        distance = torch.minimum(distance, torch.sum((xyz - centroid) ** 2, -1))
+        farthest = torch.argmax(distance, -1)
+
+    return centroids
+
+
+# farthest_point_sample_original, farthest_point_sample_fast
+if fps is None:
+    farthest_point_sample = farthest_point_sample_batched
+else:
+    farthest_point_sample = farthest_point_sample_cluster
 
 
 def knn_point(nsample: int, xyz, new_xyz):
@@ -125,21 +192,29 @@ def knn_point(nsample: int, xyz, new_xyz):
     return group_idx
 
 
-def sample_and_group(npoint: int, nsample: int, xyz, points):
+def sample_and_group(npoint: int, nsample: int, xyz, points,
+                     fps_shortcut: bool = False):
     """
     Input:
         npoint:
         nsample:
         xyz: input points position data, [B, N, C]
         points: input points data, [B, N, D]
+        fps_shortcut: sample all points without FPS if npoint >= N
     Return:
         new_xyz: sampled points position data, [B, 1, C]
         new_points: sampled points data, [B, 1, N, C+D]
     """
     B, N, C = xyz.shape
-    S = npoint
-    fps_idx = farthest_point_sample(xyz, npoint)  # [B, npoint, C]
-    new_xyz = index_points(xyz, fps_idx)
+    if fps_shortcut and npoint >= N:
+        # every point once; FPS repeats points once the remaining ones
+        # coincide with sampled ones, so models must be trained with it
+        S = N
+        new_xyz = xyz
+    else:
+        S = npoint
+        fps_idx = farthest_point_sample(xyz, npoint)  # [B, npoint, C]
+        new_xyz = index_points(xyz, fps_idx)
     idx = knn_point(nsample, xyz, new_xyz)
     grouped_xyz = index_points(xyz, idx)  # [B, npoint, nsample, C]
     grouped_xyz_norm = grouped_xyz - new_xyz.view(B, S, 1, C)
@@ -151,22 +226,58 @@ def sample_and_group(npoint: int, nsample: int, xyz, points):
     return new_xyz, new_points, grouped_xyz_norm, idx
 
 
-def sample_and_group_ds(npoint: int, nsample: int, xyz, points, density_scale):
+def sample_and_group_ds(npoint: int, nsample: int, xyz, points, density_scale,
+                        fps_shortcut: bool = False,
+                        knn_idx: Optional[torch.Tensor] = None):
     """
     Input:
         npoint:
         nsample:
         xyz: input points position data, [B, N, C]
         points: input points data, [B, N, D]
+        density_scale: per-point density scale, [B, N, 1]
+        fps_shortcut: sample all points without FPS if npoint >= N
+        knn_idx: precomputed neighbours of every input point, [B, N, nsample]
     Return:
         new_xyz: sampled points position data, [B, 1, C]
         new_points: sampled points data, [B, 1, N, C+D]
     """
     B, N, C = xyz.shape
-    S = npoint
-    fps_idx = farthest_point_sample(xyz, npoint)  # [B, npoint, C]
-    new_xyz = index_points(xyz, fps_idx)
-    idx = knn_point(nsample, xyz, new_xyz)
+    if fps_shortcut and npoint >= N:
+        # every point once; FPS repeats points once the remaining ones
+        # coincide with sampled ones, so models must be trained with it
+        new_xyz = xyz
+        if knn_idx is None:
+            idx = knn_point(nsample, xyz, new_xyz)
+        else:
+            idx = knn_idx
+    else:
+        fps_idx = farthest_point_sample(xyz, npoint)  # [B, npoint, C]
+        new_xyz = index_points(xyz, fps_idx)
+        if knn_idx is None:
+            idx = knn_point(nsample, xyz, new_xyz)
+        else:
+            idx = index_points(knn_idx, fps_idx)
+
+    new_points, grouped_xyz_norm, grouped_density = group_ds(
+        xyz, points, density_scale, new_xyz, idx)
+    return new_xyz, new_points, grouped_xyz_norm, idx, grouped_density
+
+
+def group_ds(xyz, points, density_scale, new_xyz, idx):
+    """
+    Input:
+        xyz: input points position data, [B, N, C]
+        points: input points data, [B, N, D]
+        density_scale: per-point density scale, [B, N, 1]
+        new_xyz: sampled points position data, [B, S, C]
+        idx: neighbours of the sampled points, [B, S, nsample]
+    Return:
+        new_points: sampled points data, [B, S, nsample, C+D]
+        grouped_xyz_norm: neighbour offsets, [B, S, nsample, C]
+        grouped_density: neighbour density scale, [B, S, nsample, 1]
+    """
+    B, S, C = new_xyz.shape
     grouped_xyz = index_points(xyz, idx)  # [B, npoint, nsample, C]
     grouped_xyz_norm = grouped_xyz - new_xyz.view(B, S, 1, C)
 
@@ -175,7 +286,7 @@ def sample_and_group_ds(npoint: int, nsample: int, xyz, points, density_scale):
     new_points = torch.cat([grouped_xyz_norm, grouped_points], dim=-1)
 
     grouped_density = index_points(density_scale, idx)
-    return new_xyz, new_points, grouped_xyz_norm, idx, grouped_density
+    return new_points, grouped_xyz_norm, grouped_density
 
 
 def sample_and_group_all(xyz, points):
@@ -256,6 +367,90 @@ def compute_density(xyz, bandwidth: float):
     return xyz_density
 
 
+def density_and_knn(xyz, nsample: int, bandwidth: float, chunk: int = 0,
+                    knn_density: bool = False):
+    """
+    Gaussian density and k nearest neighbours of every point from one
+    pass over the pairwise square distances, serving both
+    compute_density and knn_point. With chunk > 0, distances are
+    computed in chunk x chunk tiles, accumulating the density and
+    merging the top-k per tile, so peak memory is bounded by the chunk
+    size instead of growing with N * N.
+
+    Input:
+        xyz: input points position data, [B, N, C]
+        nsample: neighbours per point, 0 for the density only
+        bandwidth: Gaussian kernel bandwidth
+        chunk: tile size, 0 for the full [B, N, N] matrix
+        knn_density: estimate the density from the nsample neighbours
+            only instead of all points
+    Return:
+        density: per-point density, [B, N]
+        knn_idx: neighbour index of every point, [B, N, nsample]
+    """
+    B, N, C = xyz.shape
+    device = xyz.device
+    var = 2.0 * bandwidth * bandwidth
+    knn_density = knn_density and nsample > 0
+    norm = 1.0 / (N * 2.5 * bandwidth)
+
+    if chunk <= 0 or chunk >= N:
+        sqrdists = square_distance(xyz, xyz)
+
+        knn_idx = torch.zeros(B, N, 0, dtype=torch.long, device=device)
+        knn_dist = torch.zeros(B, N, 0, dtype=xyz.dtype, device=device)
+        if nsample > 0:
+            knn_dist, knn_idx = torch.topk(
+                sqrdists, nsample, dim=-1, largest=False, sorted=False)
+
+        if knn_density:
+            density = torch.exp(- knn_dist / var).sum(dim=-1) * norm
+        else:
+            density = (torch.exp(- sqrdists / var) / (2.5 * bandwidth)).mean(dim=-1)
+
+        return density, knn_idx
+
+    # tiles must hold the neighbours merged into them
+    chunk = max(chunk, nsample)
+
+    density = torch.zeros(B, N, dtype=xyz.dtype, device=device)
+    knn_idx = torch.zeros(B, N, nsample, dtype=torch.long, device=device)
+
+    for i in range(0, N, chunk):
+        query = xyz[:, i:i + chunk]
+        Q = query.shape[1]
+
+        tile_density = torch.zeros(B, Q, dtype=xyz.dtype, device=device)
+        best_dist = torch.full(
+            (B, Q, nsample), float('inf'), dtype=xyz.dtype, device=device)
+        best_idx = torch.zeros(B, Q, nsample, dtype=torch.long, device=device)
+
+        for j in range(0, N, chunk):
+            sqrdists = square_distance(query, xyz[:, j:j + chunk])
+
+            if not knn_density:
+                tile_density += torch.exp(- sqrdists / var).sum(dim=-1)
+
+            if nsample > 0:
+                k = min(nsample, sqrdists.shape[2])
+                dist, idx = torch.topk(
+                    sqrdists, k, dim=-1, largest=False, sorted=False)
+
+                dist = torch.cat([best_dist, dist], dim=-1)
+                idx = torch.cat([best_idx, idx + j], dim=-1)
+                best_dist, sel = torch.topk(
+                    dist, nsample, dim=-1, largest=False, sorted=False)
+                best_idx = torch.gather(idx, -1, sel)
+
+        if knn_density:
+            tile_density = torch.exp(- best_dist / var).sum(dim=-1)
+
+        density[:, i:i + Q] = tile_density * norm
+        knn_idx[:, i:i + Q] = best_idx
+
+    return density, knn_idx
+
+
 class DensityNet(nn.Module):
     def __init__(self, hidden_unit=[16, 8]):
         super(DensityNet, self).__init__()
@@ -315,10 +510,12 @@ class WeightNet(nn.Module):
 
 
 class PointConvSetAbstraction(nn.Module):
-    def __init__(self, npoint, nsample, in_channel, mlp, group_all):
+    def __init__(self, npoint, nsample, in_channel, mlp, group_all,
+                 fps_shortcut=False):
         super(PointConvSetAbstraction, self).__init__()
         self.npoint = npoint
         self.nsample = nsample
+        self.fps_shortcut = fps_shortcut
         self.mlp_convs = nn.ModuleList()
         self.mlp_bns = nn.ModuleList()
         last_channel = in_channel
@@ -351,7 +548,7 @@ class PointConvSetAbstraction(nn.Module):
                 xyz, points)
         else:
             new_xyz, new_points, grouped_xyz_norm, _ = sample_and_group(
-                self.npoint, self.nsample, xyz, points)
+                self.npoint, self.nsample, xyz, points, self.fps_shortcut)
         # new_xyz: sampled points position data, [B, npoint, C]
         # new_points: sampled points data, [B, npoint, nsample, C+D]
         new_points = new_points.permute(0, 3, 2, 1)  # [B, C+D, nsample,npoint]
@@ -362,7 +559,7 @@ class PointConvSetAbstraction(nn.Module):
         grouped_xyz = grouped_xyz_norm.permute(0, 3, 2, 1)
         weights = self.weightnet(grouped_xyz)
         new_points = torch.matmul(input=new_points.permute(
-            0, 3, 1, 2), other=weights.permute(0, 3, 2, 1)).view(B, self.npoint, -1)
+            0, 3, 1, 2), other=weights.permute(0, 3, 2, 1)).view(B, new_xyz.shape[1], -1)
         new_points = self.linear(new_points)
         new_points = self.bn_linear(new_points.permute(0, 2, 1))
         new_points = F.relu(new_points)
@@ -372,10 +569,14 @@ class PointConvSetAbstraction(nn.Module):
 
 
 class PointConvDensitySetAbstraction(nn.Module):
-    def __init__(self, npoint, nsample, in_channel, mlp, bandwidth, group_all):
+    def __init__(self, npoint, nsample, in_channel, mlp, bandwidth, group_all,
+                 fps_shortcut=False, chunk=0, knn_density=False):
         super(PointConvDensitySetAbstraction, self).__init__()
         self.npoint = npoint
         self.nsample = nsample
+        self.fps_shortcut = fps_shortcut
+        self.chunk = chunk
+        self.knn_density = knn_density
         self.mlp_convs = nn.ModuleList()
         self.mlp_bns = nn.ModuleList()
         last_channel = in_channel
@@ -406,7 +607,10 @@ class PointConvDensitySetAbstraction(nn.Module):
         if points is not None:
             points = points.permute(0, 2, 1)
 
-        xyz_density = compute_density(xyz, self.bandwidth)
+        # one neighbourhood pass for the density and the kNN grouping
+        xyz_density, knn_idx = density_and_knn(
+            xyz, 0 if self.group_all else self.nsample, self.bandwidth,
+            self.chunk, self.knn_density)
         inverse_density = 1.0 / xyz_density
 
         if self.group_all:
@@ -414,7 +618,8 @@ class PointConvDensitySetAbstraction(nn.Module):
                 xyz, points, inverse_density.view(B, N, 1))
         else:
             new_xyz, new_points, grouped_xyz_norm, _, grouped_density = sample_and_group_ds(
-                self.npoint, self.nsample, xyz, points, inverse_density.view(B, N, 1))
+                self.npoint, self.nsample, xyz, points,
+                inverse_density.view(B, N, 1), self.fps_shortcut, knn_idx)
         # new_xyz: sampled points position data, [B, npoint, C]
         # new_points: sampled points data, [B, npoint, nsample, C+D]
         new_points = new_points.permute(0, 3, 2, 1)  # [B, C+D, nsample,npoint]
@@ -431,7 +636,7 @@ class PointConvDensitySetAbstraction(nn.Module):
 
         new_points = torch.matmul(
             new_points.permute(0, 3, 1, 2),
-            weights.permute(0, 3, 2, 1)).view(B, self.npoint, -1)
+            weights.permute(0, 3, 2, 1)).view(B, new_xyz.shape[1], -1)
         new_points = self.linear(new_points)
         new_points = self.bn_linear(new_points.permute(0, 2, 1))
         new_points = F.relu(new_points)
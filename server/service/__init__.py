@@ -1,25 +1,237 @@
 import tornado
+import tornado.netutil
+import tornado.process
+import tornado.httpserver
 from tornado.log import enable_pretty_logging
-from service.api import api_v2_http_routes
+from service.api import get_routes
+from service.api import model_route_groups
+from service.api import select_route_groups
+from service.utils import session_pool
+from service.utils import anchor_pool
+from service.utils import prefetch_anchor_sizes
+from service.utils import configure_anchor_sizes
+from service.tracing import tracer
+from service.readiness import readiness
+from service.writer import dump_writer
+from service.writer import recording_writer
+from service.trigger import trigger as change_trigger
+from service.filtering import sh_filter as temporal_filter
+from service.executor import pin_worker_cpus
+from service.executor import inference_executor
+from service.executor import io_executor
+from service.executor import configure_executors
 
 
 enable_pretty_logging()
 
 
-def start_service(port=8550, debug=True):
+def start_service(port=8550, debug=True, device='cuda',
+                  workers=1, session_ttl=600, session_capacity=4096,
+                  session_max_mb=256, anchor_cache=None,
+                  session_anchor_sizes=None,
+                  batch_window=0.005, max_batch_size=16,
+                  inference_threads=2, io_threads=4, dump_queue=1024,
+                  recording_compress=False,
+                  trigger=False, trigger_threshold=0.02, trigger_max_skips=30,
+                  sh_filter='none', sh_filter_alpha=0.5, shed_load=0,
+                  trace_sample_rate=0.01, trace_slow_ms=100, artifact=None,
+                  routes='all', preload=True, warmup_batch_sizes=None):
     """ Holds all the registered HTTP endpoints
 
     input: All the endpoints should be defined under the routes directory
 
     calling this function will also setup the gRPC connection between
     front-end web server and the Triton inference server
+
+    Parameters
+    ----------
+    port : int
+        Port to listen on, default 8550
+    debug : bool
+        Enable Tornado debug mode and autoreload, single worker only
+    device : str
+        Inference device, e.g. 'cuda' or 'cpu', default 'cuda'
+    workers : int
+        Number of pre-forked worker processes sharing the listening
+        socket, 0 for one per CPU core, default 1
+    session_ttl : float
+        Seconds of inactivity before a session is evicted, default 600
+    session_capacity : int
+        Maximum number of live sessions, least recently used sessions
+        are evicted first, default 4096
+    session_max_mb : int
+        Memory budget for session state in MB, default 256
+    anchor_cache : str
+        Directory of memory-mapped anchor tables shared across restarts
+        and workers, None to build tables in memory, default None
+    session_anchor_sizes : list
+        Anchor sizes sessions and dumps may use, other `Anchor-Size`
+        values are answered with 400, None for 2048, 1280, 1024, 768
+        and 512, default None
+    batch_window : float
+        Seconds a lighting estimation request waits for concurrent
+        requests to join its batch, default 0.005
+    max_batch_size : int
+        Maximum number of point clouds per forward pass, default 16
+    inference_threads : int
+        Threads running forward passes, CPU cores are partitioned
+        among them for torch intra-op parallelism, default 2
+    io_threads : int
+        Threads decoding payloads and encoding dumps, default 4
+    dump_queue : int
+        Maximum number of dumps queued for writing, further dumps are
+        refused with 503, default 1024
+    recording_compress : bool
+        Compress recorded frames with zlib before they are appended to
+        the archive container, default False
+    trigger : bool
+        Answer frames whose point cloud barely changed with the session's
+        cached coefficients instead of running inference; requires
+        workers=1, default False
+    trigger_threshold : float
+        Mean color and relative distance change of observed anchors
+        that triggers a new inference, default 0.02
+    trigger_max_skips : int
+        Maximum consecutive frames answered from cache, default 30
+    sh_filter : str
+        Default temporal SH filter, 'none', 'ema' or 'kalman', sessions
+        can override it with the `SH-Filter` header; requires
+        workers=1, default 'none'
+    sh_filter_alpha : float
+        Smoothing factor of the 'ema' filter, default 0.5
+    shed_load : int
+        Serve filter predictions instead of inferring while this many
+        inferences are in flight, 0 to disable; requires workers=1,
+        default 0
+    trace_sample_rate : float
+        Share of requests whose trace is kept for
+        `/api/v2/debug/traces/`, default 0.01
+    trace_slow_ms : float
+        Traces of requests slower than this are always kept, default 100
+    artifact : str
+        TorchScript artifact to serve, None to export and cache
+        `./model/model.ckpt` on first start, default None
+    routes : str
+        Comma-separated route groups to serve, see `service.api`, e.g.
+        'dump,recording' for collection nodes that never load the
+        model; health and metrics are always served, default 'all'
+    preload : bool
+        Load the model in the background right after start instead of
+        on the first model-backed request; model-backed routes answer
+        with a "warming up" status until it is loaded, default True
+    warmup_batch_sizes : list
+        Batch sizes the model is warmed up for, for every anchor size,
+        before the worker reports ready at `/api/v2/health/ready/`,
+        None for powers of two up to `max_batch_size`, default None
     """
 
+    groups = select_route_groups(routes)
+    serve_model = any(v in groups for v in model_route_groups)
+
+    session_pool.configure(
+        ttl=session_ttl,
+        capacity=session_capacity,
+        max_bytes=session_max_mb * 1024 * 1024)
+
+    anchor_pool.configure(cache_dir=anchor_cache)
+    session_anchor_sizes = configure_anchor_sizes(session_anchor_sizes)
+
+    if serve_model:
+        # the model stack is imported by model-backed deployments only
+        from service.engine import engine
+        from service.api.lighting_estimation import batch_queue
+
+        engine.configure(artifact=artifact)
+        readiness.set('model', 'cold')
+
+    task_id = None
+    if workers != 1:
+        # Trigger and filter state is kept per session in the worker
+        # that served it, only the session table itself is shared
+        if trigger or sh_filter != 'none' or shed_load:
+            raise ValueError(
+                'trigger, sh_filter and shed_load keep per-process session '
+                'state and require workers=1')
+
+        # Sessions must be visible to every worker, and the model must
+        # be loaded after forking, one replica per worker
+        debug = False
+
+        if serve_model:
+            # export a changed checkpoint once, before forking
+            engine.configure(artifact=engine.get_artifact())
+
+        # keep the open-addressing table at most half full
+        session_pool.share(capacity=2 * session_capacity)
+
+        n_workers = workers if workers > 0 else tornado.process.cpu_count()
+
+        sockets = tornado.netutil.bind_sockets(port)
+        task_id = tornado.process.fork_processes(n_workers)
+
+        cpus = pin_worker_cpus(task_id, n_workers)
+        print(f'Worker {task_id} pinned to CPUs {cpus}')
+
+    configure_executors(
+        inference_threads=inference_threads,
+        io_threads=io_threads)
+
+    if serve_model:
+        if warmup_batch_sizes is None:
+            warmup_batch_sizes = [
+                v for v in (1, 2, 4, 8, 16, 32, 64) if v < max_batch_size]
+            warmup_batch_sizes.append(max_batch_size)
+        elif isinstance(warmup_batch_sizes, int):
+            warmup_batch_sizes = [warmup_batch_sizes]
+
+        # clients can only register the configured anchor sizes
+        engine.configure(
+            device=device,
+            n_threads=inference_executor.torch_threads,
+            warmup_anchor_sizes=session_anchor_sizes,
+            warmup_batch_sizes=warmup_batch_sizes)
+
+        batch_queue.configure(
+            window=batch_window,
+            max_batch_size=max_batch_size)
+
+    change_trigger.configure(
+        enabled=trigger,
+        threshold=trigger_threshold,
+        max_skips=trigger_max_skips)
+
+    temporal_filter.configure(
+        mode=sh_filter,
+        alpha=sh_filter_alpha,
+        shed_load=shed_load,
+        allowed_modes=temporal_filter.modes if task_id is None else ('none',))
+
+    dump_writer.configure(max_records=dump_queue)
+    recording_writer.configure(compress=recording_compress)
+
+    tracer.configure(
+        sample_rate=trace_sample_rate,
+        slow_ms=trace_slow_ms)
+
     app = tornado.web.Application(
-        [*api_v2_http_routes],
+        get_routes(groups),
         debug=debug,
         autoreload=debug)
 
-    app.listen(port)
-    print('Tornado Server Started...')
+    if task_id is None:
+        app.listen(port)
+    else:
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_sockets(sockets)
+
+    io_executor.get_pool().submit(prefetch_anchor_sizes)
+
+    if serve_model and preload:
+        engine.start_loading()
+
+    tornado.ioloop.PeriodicCallback(
+        session_pool.sweep,
+        min(session_ttl, 60) * 1000).start()
+
+    print(f'Tornado Server Started, serving {", ".join(groups)}...')
     tornado.ioloop.IOLoop.current().start()
@@ -1,17 +1,65 @@
-from .dump import dump_http_routes
-from .session import session_http_routes
-from .recording import recording_http_routes
-from .network_testing import network_testing_http_routes
-from .lighting_estimation import lighting_estimation_http_routes
-
-
-r = [
-    *dump_http_routes,
-    *session_http_routes,
-    *recording_http_routes,
-    *network_testing_http_routes,
-    *lighting_estimation_http_routes
-]
-api_v2_http_routes = [(f'/api/v2{v[0]}', v[1]) for v in r]
-
-__all__ = ['api_v2_http_routes']
+"""HTTP routes of the service, grouped by feature
+
+Route modules are imported only for the groups a deployment serves, so
+collection nodes serving dumps and recordings never import the model
+stack. The 'lighting_estimation' and 'stream' groups are model-backed:
+they answer with a "warming up" status until the model is loaded.
+"""
+
+import importlib
+
+
+route_groups = {
+    'health': ('service.api.health', 'health_http_routes'),
+    'metrics': ('service.api.metrics', 'metrics_http_routes'),
+    'dump': ('service.api.dump', 'dump_http_routes'),
+    'session': ('service.api.session', 'session_http_routes'),
+    'recording': ('service.api.recording', 'recording_http_routes'),
+    'network_testing': ('service.api.network_testing', 'network_testing_http_routes'),
+    'lighting_estimation': ('service.api.lighting_estimation', 'lighting_estimation_http_routes'),
+    'stream': ('service.api.stream', 'stream_http_routes'),
+    'debug': ('service.api.debug', 'debug_http_routes')
+}
+
+# always served, load balancers and monitoring rely on them
+base_route_groups = ('health', 'metrics')
+model_route_groups = ('lighting_estimation', 'stream')
+
+
+def select_route_groups(routes=None):
+    """Route group names of a selection, all groups for None or 'all'
+
+    `routes` is a list of group names or a comma-separated string.
+    """
+    if routes is None or routes == 'all':
+        return list(route_groups.keys())
+
+    if isinstance(routes, str):
+        routes = routes.split(',')
+
+    routes = [v.strip() for v in routes]
+    for v in routes:
+        if v not in route_groups:
+            raise ValueError(f'Unknown route group {v}')
+
+    return [v for v in route_groups if v in base_route_groups or v in routes]
+
+
+def get_routes(groups):
+    r = []
+    for name in groups:
+        module, attr = route_groups[name]
+        r.extend(getattr(importlib.import_module(module), attr))
+
+    return [(f'/api/v2{v[0]}', v[1]) for v in r]
+
+
+def __getattr__(name):
+    if name == 'api_v2_http_routes':
+        return get_routes(select_route_groups())
+
+    raise AttributeError(f'module {__name__} has no attribute {name}')
+
+
+__all__ = ['api_v2_http_routes', 'route_groups', 'model_route_groups',
+           'select_route_groups', 'get_routes']
@@ -0,0 +1,23 @@
+from service.utils import BaseHttpRouter
+from service.tracing import tracer
+
+
+class TracesHTTPHandler(BaseHttpRouter):
+    """Recent traces as Chrome trace-event JSON
+
+    Query arguments `min_ms` and `limit` select the slowest traces and
+    the number of most recent traces returned.
+    """
+
+    def get(self):
+        min_ms = float(self.get_argument('min_ms', 0))
+        limit = self.get_argument('limit', None)
+
+        self.json(tracer.export(min_ms=min_ms, limit=limit))
+
+
+debug_http_routes = [
+    (r"/debug/traces/", TracesHTTPHandler)
+]
+
+__all__ = ['debug_http_routes']
@@ -1,40 +1,181 @@
+import os
+import time
+import uuid
+
 import numpy as np
+import tornado.web
 
 from service.utils import BaseHttpRouter
 from service.utils import anchor_pool
+from service.utils import get_anchor_size
 from service.payload import payload_processors
+from service.container import encode_record
+from service.writer import dump_writer
+from service.executor import io_executor
+from service.streaming import FrameSink
 
 
+@tornado.web.stream_request_body
 class DumpHTTPHandler(BaseHttpRouter):
-    dump_root: str = './dist/xihe_service'
+    """Queue a payload for the session's rolling dump container
 
-    def post(self):
-        f_type = self.request.headers['File-Type']
-        f_name = self.request.headers['File-Name']
-        anchor_size = self.request.headers['Anchor-Size'] \
-            if 'Anchor-Size' in self.request.headers else None
+    Payloads are decoded and encoded on the IO executor and written
+    behind by `dump_writer`. Point clouds keep their non-empty anchors
+    only. Answers 503 while the write queue is full.
+
+    RGBD AR session uploads are streamed instead: frames are decoded as
+    the body arrives and written to a memory-mapped .npy file, so an
+    upload never holds more than one frame in memory.
+    """
+
+    ar_session_root: str = './dist/xihe_service/rgbd_ar_session'
+    ar_session_frame: tuple = (256 * 192, 6)
+    max_stream_bytes: int = 4 * 1024 ** 3
+
+    sink = None
+
+    async def prepare(self):
+        super().prepare()
+        self.chunks = []
+
+        f_type = self.request.headers.get('File-Type', '')
+        if f_type != 'rgbd_ar_session':
+            return
+
+        frame_bytes = int(np.prod(self.ar_session_frame)) * 4
+
+        try:
+            length = int(self.request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            self.set_status(411)
+            self.json({'ok': False, 'error': 'Content-Length required'})
+            self.finish()
+            return
+
+        if length % frame_bytes != 0 or length > self.max_stream_bytes:
+            self.set_status(400)
+            self.json({'ok': False, 'error': 'invalid AR session length'})
+            self.finish()
+            return
+
+        self.request.connection.set_max_body_size(self.max_stream_bytes)
+
+        f_name = os.path.basename(self.request.headers.get('File-Name', ''))
+        path = self.get_ar_session_path(f'{self.get_container_name(f_type)}_{f_name}')
+        if path is None:
+            self.set_status(400)
+            self.json({'ok': False, 'error': 'invalid AR session file name'})
+            self.finish()
+            return
+
+        self.sink = await io_executor.run(
+            FrameSink, path, length // frame_bytes, self.ar_session_frame)
+
+    def get_ar_session_path(self, name):
+        """Path of an AR session upload, None if it leaves the root"""
+        root = os.path.abspath(self.ar_session_root)
+        path = os.path.abspath(os.path.join(root, f'{name}.npy'))
+
+        if os.path.dirname(path) != root:
+            return None
+
+        return path
 
+    async def data_received(self, chunk):
+        if self.sink is None:
+            self.chunks.append(chunk)
+        else:
+            await io_executor.run(self.sink.write, chunk)
+
+    def on_connection_close(self):
+        if self.sink is not None:
+            io_executor.run(self.sink.discard)
+
+    def encode_dump(self, f_type, f_name, anchor_size, payload):
         processor = payload_processors[f_type]
+        meta = {'name': f_name, 'type': f_type, 'time': time.time()}
 
         if 'point_cloud' in f_type:
             if anchor_size is None:
-                pc = processor(self.request.body)
+                pc = processor(payload)
             else:
-                pc = processor(self.request.body,
-                               anchor_pool[int(anchor_size)])
-            np.save(f'{self.dump_root}/{f_name}', pc)
+                pc = processor(payload, anchor_pool[anchor_size])
+
+            index = np.flatnonzero(np.any(pc != 0, axis=-1))
+            meta['n_points'] = len(pc)
+            meta['anchor_size'] = anchor_size
+
+            return encode_record(meta, {
+                'index': index.astype('<u4'),
+                'points': pc[index].astype('<f4')
+            })
 
         elif 'log' in f_type:
-            processor(self.request.body)
+            meta['text'] = processor(payload)
+            return encode_record(meta)
+
+    def get_container_name(self, f_type):
+        try:
+            sid = str(uuid.UUID(str(self.request.headers['Session-ID'])))
+        except (KeyError, ValueError):
+            sid = 'anonymous'
 
-        elif 'ar-session' in f_type:
-            processor(self.request.body)
+        return f'{sid}_{f_type}'
+
+    async def post_stream(self):
+        try:
+            await io_executor.run(self.sink.close)
+        except ValueError as e:
+            await io_executor.run(self.sink.discard)
+            self.set_status(400)
+            self.json({'ok': False, 'error': str(e)})
+            return
+
+        self.json({'OK': True, 'frames': self.sink.n_frames})
+
+    async def post(self):
+        if self.sink is not None:
+            await self.post_stream()
+            return
+
+        f_type = self.request.headers['File-Type']
+        f_name = self.request.headers['File-Name']
+        anchor_size = self.request.headers['Anchor-Size'] \
+            if 'Anchor-Size' in self.request.headers else None
+
+        if f_type not in payload_processors:
+            self.set_status(400)
+            self.json({'ok': False, 'error': f'Unknown file type {f_type}'})
+            return
+
+        if anchor_size is not None:
+            try:
+                anchor_size = get_anchor_size(anchor_size)
+            except ValueError as e:
+                self.set_status(400)
+                self.json({'ok': False, 'error': str(e)})
+                return
+
+        record = await io_executor.run(
+            self.encode_dump, f_type, f_name, anchor_size, b''.join(self.chunks))
+
+        if not dump_writer.put(self.get_container_name(f_type), record):
+            self.set_status(503)
+            self.set_header('Retry-After', '1')
+            self.json({'ok': False, 'error': 'dump queue full'})
+            return
 
         self.json({'OK': True})
 
 
+class DumpStatsHTTPHandler(BaseHttpRouter):
+    def get(self):
+        self.json({'ok': True, 'stats': dump_writer.report()})
+
+
 dump_http_routes = [
-    (r"/dump/", DumpHTTPHandler)
+    (r"/dump/", DumpHTTPHandler),
+    (r"/dump/stats/", DumpStatsHTTPHandler)
 ]
 
 __all__ = ['dump_http_routes']
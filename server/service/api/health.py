@@ -0,0 +1,26 @@
+from service.utils import BaseHttpRouter
+from service.readiness import readiness
+
+
+class HealthHTTPHandler(BaseHttpRouter):
+    def get(self):
+        self.json({'ok': True, **readiness.report()})
+
+
+class ReadinessHTTPHandler(BaseHttpRouter):
+    """200 once every component is loaded and warmed up, 503 before"""
+
+    def get(self):
+        if not readiness.ready:
+            self.set_status(503)
+            self.set_header('Retry-After', 1)
+
+        self.json({'ok': readiness.ready, **readiness.report()})
+
+
+health_http_routes = [
+    (r"/health/", HealthHTTPHandler),
+    (r"/health/ready/", ReadinessHTTPHandler)
+]
+
+__all__ = ['health_http_routes']
@@ -1,72 +1,219 @@
 import time
-import uuid
-import torch
 
-import numpy as np
-
-from model import XiheNet
-
-from service.utils import session_pool
 from service.utils import BaseHttpRouter
-from service.payload import payload_processors
-
+from service.payload import DecodeBufferPool
+from service.payload import handle_point_cloud_xihe_optimized_inplace
+from service.engine import engine
+from service.trigger import trigger
+from service.filtering import sh_filter
+from service.response import formats
+from service.response import negotiate
+from service.response import encode_coefficients
+from service.batching import BatchQueue
+from service.executor import io_executor
+from service.executor import inference_executor
+from service.metrics import metrics
+from service.tracing import Spans
+from service.readiness import readiness
+
+
+processor = handle_point_cloud_xihe_optimized_inplace
+decode_buffers = DecodeBufferPool()
+batch_queue = BatchQueue(engine.infer, executor=inference_executor)
+
+metrics.register_gauge(
+    'xihe_inference_in_flight', 'Inferences queued or running',
+    lambda: batch_queue.in_flight)
+
+
+
+async def estimate_lighting(session, payload, filter_mode=None, spans=None):
+    """Estimate SH coefficients from a point_cloud_xihe_optimized payload
+
+    Shared by the HTTP and WebSocket endpoints. `spans` receives every
+    stage of the request, see `service.metrics`.
+    """
+    filter_mode = sh_filter.get_mode(filter_mode)
+    buf = decode_buffers.acquire(len(session['anchors']))
+
+    if spans is None:
+        spans = Spans()
+
+    try:
+        coefficients, _ = await estimate_lighting_into(
+            session, payload, filter_mode, buf, spans)
+        return coefficients
+    finally:
+        decode_buffers.release(buf)
+
+
+async def estimate_lighting_into(session, payload, filter_mode, buf, spans,
+                                 infer=None):
+    """Decode, trigger, infer and filter one frame of a session
+
+    The request pipeline of the server, also driven offline by
+    `evaluation.profile_replay`.
+
+    Input:
+        session: session dict holding the anchors and per-session state
+        payload: point_cloud_xihe_optimized payload
+        filter_mode: resolved temporal filter mode
+        buf: decode buffer of the session's anchor size
+        spans: recorder of the stage spans
+        infer: awaitable `infer(xyz, rgb, spans)` of a single point
+            cloud, `batch_queue.submit` by default
+    Return:
+        coefficients: SH coefficients answered for the frame, [27]
+        source: 'inferred', 'trigger' or 'filter'
+    """
+    if infer is None:
+        infer = batch_queue.submit
+
+    # Get point cloud, channel-first [6, N]
+    pc = await io_executor.run(
+        spans.timed, 'decode', processor, payload, session['anchors'], buf)
+
+    # Skip inference if the point cloud barely changed
+    if trigger.enabled:
+        frame, coefficients = spans.timed(
+            'trigger', trigger.check, session, pc.T)
+        if coefficients is not None:
+            predicted = sh_filter.predict(session, filter_mode)
+            if predicted is None:
+                return coefficients, 'trigger'
+            return predicted, 'filter'
+
+    # Serve predictions while the model is saturated
+    if sh_filter.should_shed(session, batch_queue.in_flight, filter_mode):
+        return sh_filter.predict(session, filter_mode), 'filter'
+
+    xyz = pc[:3]
+    rgb = pc[3:]
+
+    # Inference, batched with concurrent requests
+    t_inference = time.perf_counter()
+    p = await infer(xyz, rgb, spans)
+    t_inference = time.perf_counter() - t_inference
+
+    coefficients = p.reshape((-1))
+
+    if trigger.enabled:
+        trigger.update(session, frame, coefficients, t_inference)
+
+    coefficients = spans.timed(
+        'postprocess', sh_filter.update, session, coefficients, filter_mode)
+
+    return coefficients, 'inferred'
+
+
+class ModelHttpRouter(BaseHttpRouter):
+    """Routes that need the model loaded
+
+    Until the model is ready, requests are answered with 503 and a
+    "warming up" status, and the first one starts loading the model
+    unless `start_service` already does so in the background.
+    """
 
-model = XiheNet.load_from_checkpoint(f'./model/model.ckpt')
-_ = model.eval().cuda()
-scripted_model = torch.jit.script(model)
+    def check_model(self) -> bool:
+        if engine.ready:
+            return True
+
+        engine.start_loading()
+        model = readiness.components.get('model', {})
 
-n_scale = torch.Tensor(model.hparams['scale'])
-n_min = torch.Tensor(model.hparams['min'])
-processor = payload_processors['point_cloud_xihe_optimized']
+        if model.get('state') == 'failed':
+            self.set_status(500)
+            self.json({
+                'ok': False, 'status': 'failed', 'error': model.get('error')})
+        else:
+            self.set_status(503)
+            self.set_header('Retry-After', 1)
+            self.json({'ok': False, 'status': 'warming_up'})
+
+        return False
+
+
+class LightingEstimationHTTPHandler(ModelHttpRouter):
+    def get_sequence_number(self) -> int:
+        """`Sequence-Number` header echoed in binary responses, a uint32"""
+        value = self.request.headers.get('Sequence-Number', '0')
+        try:
+            seq = int(value)
+        except ValueError:
+            seq = -1
+
+        if not 0 <= seq <= 0xFFFFFFFF:
+            raise ValueError(
+                f'Sequence-Number must be an integer in [0, 2^32), '
+                f'got {value!r}')
+
+        return seq
+
+    async def post(self):
+        if not self.check_model():
+            return
 
-# f = open('./dist/perf/edge_processing_time.csv', 'w', buffering=1)
-# f.write('component,time\n')
+        # Get meta info
+        sid, session = self.get_session()
 
+        try:
+            filter_mode = sh_filter.get_mode(
+                self.request.headers.get('SH-Filter'))
+            seq = self.get_sequence_number()
+        except ValueError as e:
+            self.set_status(400)
+            self.json({'ok': False, 'error': str(e)})
+            return
 
-class LightingEstimationHTTPHandler(BaseHttpRouter):
-    def post(self):
-        # t0 = time.time()
+        coefficients = await estimate_lighting(
+            session, self.request.body, filter_mode, self.trace)
 
-        # Get meta info
-        sid = uuid.UUID(str(self.request.headers['Session-ID']))
-        session = session_pool[sid]
+        with self.trace.span('serialize'):
+            fmt = negotiate(self.request.headers.get('Accept'))
+            if fmt == 'json':
+                coefficients = coefficients.tolist()
+                self.json({'ok': True, 'coefficients': coefficients})
+            else:
+                self.set_header('Content-Type', formats[fmt]['media_type'])
+                self.write(encode_coefficients(
+                    coefficients, fmt, seq=seq,
+                    model_version=engine.model_version))
 
-        # Get point cloud
-        pc = processor(self.request.body, session['anchors'])
-        # session['point_clouds'].append(pc)
-        # pc = np.random.rand(1280, 6).astype(np.float32)
+        metrics.observe_stages(
+            self.request.path, session['anchor_size'], self.trace.durations())
 
-        # np.savetxt('./dist/lighting_estimation/point_cloud.txt', pc)
-        # np.save('./dist/lighting_estimation/received', pc)
 
-        xyz = np.moveaxis(pc[:, :3], 0, -1)[np.newaxis, ::]
-        rgb = np.moveaxis(pc[:, 3:], 0, -1)[np.newaxis, ::]
+class BatchingStatsHTTPHandler(BaseHttpRouter):
+    def get(self):
+        self.json({
+            'ok': True,
+            'window': batch_queue.window,
+            'max_batch_size': batch_queue.max_batch_size,
+            'stats': batch_queue.stats.report()
+        })
 
-        xyz = torch.from_numpy(xyz).cuda()
-        rgb = torch.from_numpy(rgb).cuda()
 
-        # Inference
-        # t1 = time.time()
-        p = scripted_model.forward(xyz, rgb).detach().cpu()
-        # t2 = time.time()
-        p = (p - n_min) / n_scale
-        p = p.numpy()
-        coefficients = p.reshape((-1))
+class EngineStatsHTTPHandler(BaseHttpRouter):
+    def get(self):
+        self.json({'ok': True, 'stats': engine.report()})
 
-        coefficients = coefficients.tolist()
-        self.json({'ok': True, 'coefficients': coefficients})
 
-        # t3 = time.time()
+class TriggerStatsHTTPHandler(BaseHttpRouter):
+    def get(self):
+        self.json({'ok': True, 'stats': trigger.report()})
 
-        # t_inference = t2 - t1
-        # t_processing = t3 - t0 - t_inference
 
-        # f.write(f'processing,{t_processing}\n')
-        # f.write(f'inference,{t_inference}\n')
+class FilterStatsHTTPHandler(BaseHttpRouter):
+    def get(self):
+        self.json({'ok': True, 'stats': sh_filter.report()})
 
 
 lighting_estimation_http_routes = [
-    (r"/lighting-estimation/", LightingEstimationHTTPHandler)
+    (r"/lighting-estimation/", LightingEstimationHTTPHandler),
+    (r"/lighting-estimation/batching/", BatchingStatsHTTPHandler),
+    (r"/lighting-estimation/engine/", EngineStatsHTTPHandler),
+    (r"/lighting-estimation/trigger/", TriggerStatsHTTPHandler),
+    (r"/lighting-estimation/filter/", FilterStatsHTTPHandler)
 ]
 
-__all__ = ['lighting_estimation_http_routes']
+__all__ = ['lighting_estimation_http_routes', 'batch_queue', 'estimate_lighting']
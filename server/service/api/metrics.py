@@ -0,0 +1,15 @@
+from service.utils import BaseHttpRouter
+from service.metrics import metrics
+
+
+class MetricsHTTPHandler(BaseHttpRouter):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(metrics.render())
+
+
+metrics_http_routes = [
+    (r"/metrics/?", MetricsHTTPHandler)
+]
+
+__all__ = ['metrics_http_routes']
@@ -3,6 +3,7 @@ import base64
 import numpy as np
 
 from service.utils import BaseHttpRouter
+from service.executor import io_executor
 
 
 class NetworkTestingDataDecoder:
@@ -16,7 +17,7 @@ class NetworkTestingDataDecoder:
         anchor_clr = np.frombuffer(data, dtype=np.float32)
         return anchor_clr
 
-    def xihe_decode(self, data):
+    def xihe_decode(self, data, n_anchors=1280):
         data = data.split(',')
 
         bytes_clr = base64.decodebytes(data[1].encode())
@@ -27,12 +28,12 @@ class NetworkTestingDataDecoder:
 
         arr_clr = arr_clr.reshape((-1, 3))
 
-        anchor_clr = np.zeros((1280, 3), dtype=np.float32)
+        anchor_clr = np.zeros((n_anchors, 3), dtype=np.float32)
         anchor_clr[arr_idx] = arr_clr
 
         return anchor_clr
 
-    def xihe_bytes_decode(self, data):
+    def xihe_bytes_decode(self, data, n_anchors=1280):
         pivot = int.from_bytes(data[:2], byteorder='little')
 
         bytes_idx = data[2:pivot * 2 + 2]
@@ -43,12 +44,12 @@ class NetworkTestingDataDecoder:
 
         arr_clr = arr_clr.reshape((-1, 3))
 
-        anchor_clr = np.zeros((1280, 3), dtype=np.float32)
+        anchor_clr = np.zeros((n_anchors, 3), dtype=np.float32)
         anchor_clr[arr_idx] = arr_clr
 
         return anchor_clr
 
-    def xihe_bytes_decode_fast(self, data):
+    def xihe_bytes_decode_fast(self, data, n_anchors=1280):
         arr_bytes = np.frombuffer(data, dtype=np.byte)
         arr_bytes = arr_bytes.reshape((-1, (2 + 4 * 3)))
 
@@ -56,20 +57,22 @@ class NetworkTestingDataDecoder:
         arr_clr = np.frombuffer(arr_bytes[:, 2:].tobytes(), dtype=np.float32)
         arr_clr = arr_clr.reshape((-1, 3))
 
-        anchor_clr = np.zeros((1280, 3), dtype=np.float32)
+        anchor_clr = np.zeros((n_anchors, 3), dtype=np.float32)
         anchor_clr[arr_idx] = arr_clr
 
         return anchor_clr
 
 
 class NetworkTestingLogHTTPRouter(BaseHttpRouter, NetworkTestingDataDecoder):
-    def post(self):
+    async def post(self):
         # body = self.get_body_json()
 
         if self.request.headers['encoding'] == 'xihe':
-            anchor_clr = self.xihe_bytes_decode_fast(self.request.body)
+            anchor_clr = await io_executor.run(
+                self.xihe_bytes_decode_fast, self.request.body)
         elif self.request.headers['encoding'] == 'naive':
-            anchor_clr = self.naive_bytes_decode(self.request.body)
+            anchor_clr = await io_executor.run(
+                self.naive_bytes_decode, self.request.body)
         else:
             self.set_status(400)
             return
@@ -78,15 +81,18 @@ class NetworkTestingLogHTTPRouter(BaseHttpRouter, NetworkTestingDataDecoder):
 
 
 class NetworkTestingClientLogFileHTTPRouter(BaseHttpRouter):
-    def post(self):
-        body = self.get_body_json()
-        client_log = body['data']
-
+    def save_client_log(self, client_log):
         g = glob.glob('./dump/network-testing/*_client.csv')
         f = open(f'./dump/network-testing/{len(g)}_client.csv', 'w')
         f.write(client_log)
         f.close()
 
+    async def post(self):
+        body = self.get_body_json()
+        client_log = body['data']
+
+        await io_executor.run(self.save_client_log, client_log)
+
         print('New measurement results received')
 
         self.json({'ok': True})
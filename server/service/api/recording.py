@@ -1,53 +1,141 @@
 import os
 import json
-import imageio
+import time
 import numpy as np
+import tornado.web
 from datetime import datetime
 
 from service.utils import BaseHttpRouter
+from service.executor import io_executor
+from service.container import encode_record
+from service.writer import recording_writer
 
 
+@tornado.web.stream_request_body
 class RecordingHTTPHandler(BaseHttpRouter):
-    def post(self):
-        t_payload = self.request.headers['Payload-Type']
+    """Recorded AR session frames
 
-        if t_payload == 'info':
-            archive_name = datetime.now().strftime('%Y/%m/%d/%H_%M_%S')
-            p_probe = self.request.headers['Probe-Position']
+    Frames are appended as raw records to a single container per
+    archive, `<archive>/frames.<pid>.<part>.xrec`, see
+    `service.container`. PNG and video encoding is left to the offline
+    `./launch.py export_rec` tool.
 
-            os.system(f'mkdir -p ./dist/recording/{archive_name}')
-            with open(f'./dist/recording/{archive_name}/info.yaml', 'w') as f:
-                f.write(json.dumps({'p_probe': p_probe}))
+    A request carries exactly one 4:3 frame, its Content-Length is
+    checked against the frame size before the body is accepted and the
+    body is received into a single preallocated buffer.
+    """
 
-            self.json({'Ok': True, 'ArchiveName': archive_name})
+    # bytes per pixel of each frame type
+    pixel_bytes = {'rgb': 3, 'depth': 4}
+    max_frame_bytes = 64 * 1024 * 1024
 
+    body = None
+
+    async def prepare(self):
+        super().prepare()
+
+        t_payload = self.request.headers.get('Payload-Type')
+        if t_payload not in self.pixel_bytes:
             return
 
-        archive_name = self.request.headers['Archive-Name']
-        n_frame = self.request.headers['Number-Frame']
+        try:
+            length = int(self.request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            self.set_status(411)
+            self.json({'Ok': False, 'Error': 'Content-Length required'})
+            self.finish()
+            return
+
+        if self.get_frame_shape(t_payload, length) is None:
+            self.set_status(400)
+            self.json({'Ok': False, 'Error': f'Invalid {t_payload} frame length'})
+            self.finish()
+            return
+
+        self.body = bytearray(length)
+        self.received = 0
+
+    def data_received(self, chunk):
+        if self.body is not None:
+            n = self.received + len(chunk)
+            self.body[self.received:n] = chunk
+            self.received = n
+
+    def get_frame_shape(self, t_payload, length):
+        """(height, width) of a frame of `length` bytes, None if invalid"""
+        if length <= 0 or length > self.max_frame_bytes:
+            return None
+
+        pixels, rest = divmod(length, self.pixel_bytes[t_payload])
+        base = int(np.sqrt(pixels // 12))
+        if rest != 0 or base * base * 12 != pixels:
+            return None
+
+        return base * 3, base * 4
+
+    def get_archive_name(self):
+        archive_name = os.path.normpath(self.request.headers['Archive-Name'])
+        if archive_name.startswith(('..', '/')):
+            raise ValueError(f'Invalid archive name {archive_name}')
+
+        return archive_name
+
+    def save_info(self, archive_name, p_probe):
+        p = f'{recording_writer.root}/{archive_name}'
+        os.makedirs(p, exist_ok=True)
+
+        with open(f'{p}/info.yaml', 'w') as f:
+            f.write(json.dumps({'p_probe': p_probe}))
 
-        os.system(f'mkdir -p ./dist/recording/{archive_name}/{n_frame}/')
+    def encode_frame(self, t_payload, n_frame, payload):
+        height, width = self.get_frame_shape(t_payload, len(payload))
 
         if t_payload == 'rgb':
-            data = np.frombuffer(self.request.body, dtype=np.uint8)
-            base = int(np.sqrt(data.shape[0] // 3 // 12))
-            width, height = base * 4, base * 3
+            data = np.frombuffer(payload, dtype=np.uint8)
             data = data.reshape((height, width, 3))
 
-            imageio.imsave(
-                f'./dist/recording/{archive_name}/{n_frame}/rgb.png', data)
-
         elif t_payload == 'depth':
-            data = np.frombuffer(self.request.body, dtype=np.float32)
-            base = int(np.sqrt(data.shape[0] // 12))
-            width, height = base * 4, base * 3
-            data = data.reshape((height, width, 1))
+            data = np.frombuffer(payload, dtype=np.float32)
+            data = data.reshape((height, width))
+
+        meta = {'frame': int(n_frame), 'type': t_payload, 'time': time.time()}
+
+        return encode_record(
+            meta, {'data': data}, compress=recording_writer.compress)
+
+    async def post(self):
+        t_payload = self.request.headers['Payload-Type']
+
+        if t_payload == 'info':
+            archive_name = datetime.now().strftime('%Y/%m/%d/%H_%M_%S')
+            p_probe = self.request.headers['Probe-Position']
 
-            imageio.imsave(
-                f'./dist/recording/{archive_name}/{n_frame}/depth.png', data)
+            await io_executor.run(self.save_info, archive_name, p_probe)
 
-            with open(f'./dist/recording/{archive_name}/{n_frame}/depth.bytes', 'wb') as f:
-                f.write(self.request.body)
+            self.json({'Ok': True, 'ArchiveName': archive_name})
+
+            return
+
+        if t_payload not in self.pixel_bytes:
+            self.set_status(400)
+            self.json({'Ok': False, 'Error': f'Unknown payload type {t_payload}'})
+            return
+
+        try:
+            archive_name = self.get_archive_name()
+            record = await io_executor.run(
+                self.encode_frame, t_payload,
+                self.request.headers['Number-Frame'], self.body)
+        except ValueError as e:
+            self.set_status(400)
+            self.json({'Ok': False, 'Error': str(e)})
+            return
+
+        if not recording_writer.put(f'{archive_name}/frames', record):
+            self.set_status(503)
+            self.set_header('Retry-After', '1')
+            self.json({'Ok': False, 'Error': 'recording queue full'})
+            return
 
         self.json({'Ok': True})
 
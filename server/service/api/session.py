@@ -4,25 +4,41 @@ import uuid
 import numpy as np
 import tornado.websocket
 
+from service.utils import session_pool
 from service.utils import BaseHttpRouter
 from service.utils import register_session
+from service.utils import get_anchor_size
 from service.utils import register_anchor_size
+from service.executor import io_executor
 
 
 class SessionHTTPHandler(BaseHttpRouter):
-    def post(self):
+    async def post(self):
         sid = uuid.uuid4()
 
-        anchor_size = int(self.request.headers['Anchor-Size'])
-        anchors = register_anchor_size(anchor_size)
+        try:
+            anchor_size = get_anchor_size(
+                self.request.headers.get('Anchor-Size'))
+        except ValueError as e:
+            self.set_status(400)
+            self.json({'ok': False, 'error': str(e)})
+            return
+
+        anchors = await io_executor.run(register_anchor_size, anchor_size)
 
         register_session(sid, anchors)
 
         self.json({'ok': True, 'sid': str(sid)})
 
 
+class SessionStatsHTTPHandler(BaseHttpRouter):
+    def get(self):
+        self.json({'ok': True, 'stats': session_pool.report()})
+
+
 session_http_routes = [
-    (r"/session/", SessionHTTPHandler)
+    (r"/session/", SessionHTTPHandler),
+    (r"/session/stats/", SessionStatsHTTPHandler)
 ]
 
 __all__ = ['session_http_routes']
@@ -0,0 +1,144 @@
+import uuid
+import struct
+
+import tornado.websocket
+from tornado.ioloop import IOLoop
+
+from service.utils import session_pool
+from service.engine import engine
+from service.filtering import sh_filter
+from service.metrics import metrics
+from service.tracing import tracer
+from service.response import formats
+from service.response import encode_coefficients
+from service.api.lighting_estimation import estimate_lighting
+
+
+class SessionStreamHandler(tornado.websocket.WebSocketHandler):
+    """Per-frame lighting estimation over a persistent WebSocket
+
+    The socket is bound to a session by the `Session-ID` header or the
+    `sid` query argument, the SH filter by the `SH-Filter` header or the
+    `filter` query argument. Each binary client frame is a little-endian
+    uint32 sequence number followed by a point_cloud_xihe_optimized
+    payload. Every frame is answered with a binary reply in the format
+    of `service.response` carrying the same sequence number, float32 or
+    float16 as chosen by the `format` query argument. Frames are
+    processed concurrently, so replies may arrive out of order; frames
+    beyond `max_in_flight` are dropped and answered with STATUS_DROPPED,
+    frames received before the model is loaded with STATUS_WARMING_UP.
+    """
+
+    frame_header = struct.Struct('<I')
+
+    STATUS_OK = 0
+    STATUS_SESSION_NOT_FOUND = 1
+    STATUS_DROPPED = 2
+    STATUS_BAD_FRAME = 3
+    STATUS_ERROR = 4
+    STATUS_WARMING_UP = 5
+
+    status_names = (
+        'ok', 'session_not_found', 'dropped', 'bad_frame', 'error',
+        'warming_up')
+
+    max_in_flight: int = 8
+
+    def open(self):
+        sid = self.request.headers.get('Session-ID') or \
+            self.get_argument('sid', None)
+
+        try:
+            self.sid = uuid.UUID(str(sid))
+            session_pool[self.sid]
+        except (KeyError, ValueError):
+            self.close(4404, 'session not found, please re-register')
+            return
+
+        try:
+            self.filter_mode = sh_filter.get_mode(
+                self.request.headers.get('SH-Filter') or
+                self.get_argument('filter', None))
+        except ValueError as e:
+            self.close(4400, str(e))
+            return
+
+        self.fmt = self.get_argument('format', 'f32')
+        if self.fmt not in formats:
+            self.close(4400, f'Unknown format {self.fmt}')
+            return
+
+        self.in_flight = 0
+        self.set_nodelay(True)
+
+    def on_message(self, message):
+        trace = tracer.start(self.request.path)
+        metrics.start_request(self.request.path)
+
+        if not isinstance(message, bytes) or \
+                len(message) < self.frame_header.size:
+            self.reply(trace, 0, self.STATUS_BAD_FRAME)
+            return
+
+        seq, = self.frame_header.unpack_from(message)
+
+        if not engine.ready:
+            engine.start_loading()
+            self.reply(trace, seq, self.STATUS_WARMING_UP)
+            return
+
+        if self.in_flight >= self.max_in_flight:
+            self.reply(trace, seq, self.STATUS_DROPPED)
+            return
+
+        self.in_flight += 1
+        IOLoop.current().spawn_callback(
+            self.process_frame, trace, seq, message)
+
+    async def process_frame(self, trace, seq, message):
+        try:
+            session = session_pool[self.sid]
+        except KeyError:
+            self.in_flight -= 1
+            self.reply(trace, seq, self.STATUS_SESSION_NOT_FOUND)
+            self.close(4404, 'session not found, please re-register')
+            return
+
+        payload = memoryview(message)[self.frame_header.size:]
+
+        try:
+            coefficients = await estimate_lighting(
+                session, payload, self.filter_mode, trace)
+        except ValueError:
+            self.reply(trace, seq, self.STATUS_BAD_FRAME)
+            return
+        except Exception:
+            self.reply(trace, seq, self.STATUS_ERROR)
+            raise
+        finally:
+            self.in_flight -= 1
+
+        self.reply(trace, seq, self.STATUS_OK, coefficients)
+
+        metrics.observe_stages(
+            self.request.path, session['anchor_size'], trace.durations())
+
+    def reply(self, trace, seq, status, coefficients=None):
+        """Answer a frame and record it in the metrics and its trace"""
+        if self.ws_connection is not None:
+            with trace.span('serialize'):
+                data = encode_coefficients(
+                    coefficients, self.fmt, status=status, seq=seq,
+                    model_version=engine.model_version)
+                self.write_message(data, binary=True)
+
+        status = self.status_names[status]
+        metrics.finish_request(self.request.path, status, trace.duration)
+        tracer.finish(trace, status=status, seq=seq)
+
+
+stream_http_routes = [
+    (r"/session/stream/", SessionStreamHandler)
+]
+
+__all__ = ['stream_http_routes']
@@ -0,0 +1,159 @@
+"""Dynamic micro-batching
+
+Concurrent lighting estimation requests are collected within a short
+time window and executed as one batched forward pass. Requests are
+grouped by their number of points, as only point clouds of the same
+anchor size can be stacked into one batch. Batches are executed on an
+executor when one is given, keeping the IOLoop free to collect the next
+batch while the current one is running.
+"""
+
+import time
+import collections
+
+import numpy as np
+from tornado.ioloop import IOLoop
+from tornado.concurrent import Future
+
+from service.tracing import Spans
+
+
+class BatchStats:
+    """Batch size distribution and queueing delay of a batch queue"""
+
+    def __init__(self, history=4096):
+        self.batch_sizes = collections.Counter()
+        self.queue_delays = collections.deque(maxlen=history)
+
+    def record(self, batch_size, delays):
+        self.batch_sizes[batch_size] += 1
+        self.queue_delays.extend(delays)
+
+    def report(self):
+        n_batches = sum(self.batch_sizes.values())
+        n_requests = sum(k * v for k, v in self.batch_sizes.items())
+
+        delays = np.array(self.queue_delays, dtype=np.float64) * 1000
+        if len(delays) == 0:
+            delays = np.zeros((1), dtype=np.float64)
+
+        return {
+            'n_batches': n_batches,
+            'n_requests': n_requests,
+            'mean_batch_size': n_requests / n_batches if n_batches else 0,
+            'batch_size': {
+                str(k): self.batch_sizes[k]
+                for k in sorted(self.batch_sizes)},
+            'queue_delay_ms': {
+                'mean': float(delays.mean()),
+                'p50': float(np.percentile(delays, 50)),
+                'p95': float(np.percentile(delays, 95)),
+                'p99': float(np.percentile(delays, 99)),
+                'max': float(delays.max())
+            }
+        }
+
+
+class BatchQueue:
+    """Server-side batching queue for model inference
+
+    Parameters
+    ----------
+    batch_fn : callable
+        Function mapping batched inputs `xyz, rgb` of shape [B, 3, N]
+        to a [B, ...] array of per-sample results, and recording its
+        stages into the `Spans` passed as `spans`
+    window : float
+        Maximum time in seconds a request waits for its batch to fill
+    max_batch_size : int
+        A batch is executed as soon as it reaches this size
+    executor : BoundedExecutor
+        Executor running `batch_fn`, None to run it on the IOLoop
+    """
+
+    def __init__(self, batch_fn, window=0.005, max_batch_size=16,
+                 executor=None):
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        self.pending = {}
+        self.timers = {}
+        self.in_flight = 0
+        self.stats = BatchStats()
+
+    def configure(self, window=None, max_batch_size=None):
+        if window is not None:
+            self.window = float(window)
+
+        if max_batch_size is not None:
+            self.max_batch_size = max(1, int(max_batch_size))
+
+    def submit(self, xyz: np.ndarray, rgb: np.ndarray,
+               spans: Spans = None) -> Future:
+        """Queue a single point cloud, xyz and rgb of shape [3, N]
+
+        The returned future resolves to this sample's result. `spans`
+        receives the time spent queued and the stages of the batch the
+        sample was executed in.
+        """
+        key = xyz.shape[-1]
+        future = Future()
+        future.add_done_callback(self.on_done)
+        self.in_flight += 1
+
+        queue = self.pending.setdefault(key, [])
+        queue.append((xyz, rgb, future, time.perf_counter(), spans))
+
+        if len(queue) >= self.max_batch_size or self.window <= 0:
+            self.flush(key)
+        elif key not in self.timers:
+            self.timers[key] = IOLoop.current().call_later(
+                self.window, self.flush, key)
+
+        return future
+
+    def on_done(self, future):
+        self.in_flight -= 1
+
+    def flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            IOLoop.current().remove_timeout(timer)
+
+        batch = self.pending.pop(key, [])
+        if len(batch) == 0:
+            return
+
+        t_start = time.perf_counter()
+        self.stats.record(len(batch), [t_start - v[3] for v in batch])
+
+        IOLoop.current().spawn_callback(self.run_batch, batch)
+
+    def execute(self, xyz, rgb, spans):
+        t_start = time.perf_counter()
+        return t_start, self.batch_fn(xyz, rgb, spans=spans)
+
+    async def run_batch(self, batch):
+        xyz = np.stack([v[0] for v in batch])
+        rgb = np.stack([v[1] for v in batch])
+        spans = Spans()
+
+        try:
+            if self.executor is None:
+                t_start, results = self.execute(xyz, rgb, spans)
+            else:
+                t_start, results = await self.executor.run(
+                    self.execute, xyz, rgb, spans)
+        except Exception as e:
+            for v in batch:
+                v[2].set_exception(e)
+            return
+
+        for i, (_, _, future, t_submit, sample_spans) in enumerate(batch):
+            if sample_spans is not None:
+                sample_spans.add('queue', t_submit, t_start)
+                sample_spans.extend(spans)
+
+            future.set_result(results[i])
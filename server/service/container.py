@@ -0,0 +1,195 @@
+"""Append-only record containers
+
+Many small dumps are appended as records to a few large files instead
+of one file each. A container is a sequence of records:
+
+    4 bytes   magic, b'XREC'
+    uint32    length of the JSON header
+    uint64    length of the body
+    header    JSON object, utf-8
+    body      raw array data
+
+All integers are little-endian. The header holds the record's metadata
+and an 'arrays' list describing the arrays packed in the body by key,
+dtype, shape and offset. With 'codec': 'zlib' in the header, the body
+is zlib compressed. Containers roll over to a new part file once they
+exceed their size limit, a truncated record at the end of a file left
+by a crash is skipped when reading. The headers double as an index of
+the container, `index_records` reads them without touching the bodies.
+"""
+
+import os
+import json
+import glob
+import zlib
+import struct
+
+import numpy as np
+
+
+record_header = struct.Struct('<4sIQ')
+record_magic = b'XREC'
+
+
+def encode_record(meta: dict, arrays: dict = None, compress=False) -> bytes:
+    """Pack metadata and named arrays into one record
+
+    With `compress`, the body is compressed with zlib at level 1.
+    """
+    arrays = arrays or {}
+
+    descriptors = []
+    chunks = []
+    offset = 0
+
+    for key, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        descriptors.append({
+            'key': key,
+            'dtype': arr.dtype.str,
+            'shape': list(arr.shape),
+            'offset': offset
+        })
+        chunks.append(arr.tobytes())
+        offset += arr.nbytes
+
+    body = b''.join(chunks)
+    if compress:
+        meta = {**meta, 'codec': 'zlib'}
+        body = zlib.compress(body, 1)
+
+    header = json.dumps({**meta, 'arrays': descriptors}).encode('utf-8')
+
+    return b''.join([
+        record_header.pack(record_magic, len(header), len(body)),
+        header, body])
+
+
+def decode_arrays(descriptors, body):
+    arrays = {}
+
+    for v in descriptors:
+        dtype = np.dtype(v['dtype'])
+        count = int(np.prod(v['shape'])) if len(v['shape']) > 0 else 1
+        offset = v['offset']
+
+        arr = body[offset:offset + count * dtype.itemsize]
+        arrays[v['key']] = arr.view(dtype).reshape(v['shape'])
+
+    return arrays
+
+
+def read_records(path):
+    """Yield `(meta, arrays)` of every complete record of a container
+
+    Arrays of uncompressed records are read-only views of a memory map
+    of the file.
+    """
+    if os.path.getsize(path) == 0:
+        return
+
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    pos = 0
+
+    while pos + record_header.size <= len(data):
+        magic, header_len, body_len = record_header.unpack_from(data, pos)
+        if magic != record_magic:
+            raise ValueError(f'Corrupt record at {path}:{pos}')
+
+        start = pos + record_header.size + header_len
+        end = start + body_len
+        if end > len(data):
+            break
+
+        meta = json.loads(bytes(data[pos + record_header.size:start]))
+
+        body = data[start:end]
+        if meta.get('codec') == 'zlib':
+            body = np.frombuffer(zlib.decompress(body), dtype=np.uint8)
+
+        yield meta, decode_arrays(meta.pop('arrays'), body)
+
+        pos = end
+
+
+def index_records(path):
+    """Offsets and metadata of the complete records of a container"""
+    index = []
+    size = os.path.getsize(path)
+
+    with open(path, 'rb') as f:
+        pos = 0
+        while pos + record_header.size <= size:
+            f.seek(pos)
+            magic, header_len, body_len = record_header.unpack(
+                f.read(record_header.size))
+            if magic != record_magic:
+                raise ValueError(f'Corrupt record at {path}:{pos}')
+
+            end = pos + record_header.size + header_len + body_len
+            if end > size:
+                break
+
+            index.append((pos, json.loads(f.read(header_len))))
+            pos = end
+
+    return index
+
+
+def container_parts(root, name):
+    """Part files of a container, in write order"""
+    paths = glob.glob(os.path.join(root, f'{name}.*.xrec'))
+    return sorted(paths, key=lambda p: tuple(
+        int(v) for v in os.path.basename(p).split('.')[-3:-1]))
+
+
+class RollingContainer:
+    """Append-only container split into parts of at most `max_bytes`
+
+    Parts are named `<name>.<pid>.<part>.xrec`, so processes sharing a
+    directory never append to the same file.
+    """
+
+    def __init__(self, root, name, max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.name = name
+        self.max_bytes = max_bytes
+
+        self.part = 0
+        self.file = None
+        self.size = 0
+
+    @property
+    def path(self):
+        return os.path.join(
+            self.root, f'{self.name}.{os.getpid()}.{self.part}.xrec')
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # continue after the parts left by an earlier run
+        while os.path.exists(self.path) and \
+                os.path.getsize(self.path) >= self.max_bytes:
+            self.part += 1
+
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+
+    def append(self, records):
+        """Append encoded records with a single write"""
+        if self.file is None:
+            self.open()
+        elif self.size >= self.max_bytes:
+            self.close()
+            self.part += 1
+            self.open()
+
+        data = b''.join(records)
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
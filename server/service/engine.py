@@ -0,0 +1,358 @@
+"""XiheNet inference engine
+
+Wraps the TorchScript XiheNet model behind a device-agnostic `infer`
+call, so the service runs on CUDA and CPU-only nodes alike.
+
+The model is served from a self-contained TorchScript artifact that
+carries the `min`/`scale` normalization hparams, loaded with plain
+`torch.jit.load`. Artifacts are named after the SHA-256 of their
+checkpoint, `model.<digest>.torchscript.pt` next to `model.ckpt`, so a
+changed checkpoint is exported again on the next start; only exporting
+imports PyTorch Lightning and the training modules.
+"""
+
+import os
+import glob
+import json
+import time
+import zlib
+import hashlib
+import threading
+import collections
+
+import torch
+import numpy as np
+
+from service.tracing import Spans
+from service.readiness import readiness
+
+
+# torch.inference_mode is not available before PyTorch 1.9
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+
+def hash_checkpoint(path):
+    """SHA-256 digest and 16 bit CRC32 model version of a checkpoint"""
+    sha = hashlib.sha256()
+    crc = 0
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+
+    return sha.hexdigest(), crc & 0xFFFF
+
+
+def artifact_path(checkpoint, digest):
+    root, _ = os.path.splitext(checkpoint)
+    return f'{root}.{digest[:16]}.torchscript.pt'
+
+
+def export_model(checkpoint='./model/model.ckpt', output=None,
+                 neighbourhood_chunk=None):
+    """Export a XiheNet checkpoint as a TorchScript artifact
+
+    Parameters
+    ----------
+    checkpoint : str
+        Path to the XiheNet checkpoint
+    output : str
+        Path of the artifact, named after the checkpoint digest by
+        default. Artifacts of earlier checkpoints are removed then
+    neighbourhood_chunk : int
+        Tile size of the pairwise distances, bounding memory for large
+        anchor sizes and batches, 0 for full matrices, None to follow
+        the checkpoint hparams
+    """
+    from model import XiheNet
+
+    digest, model_version = hash_checkpoint(checkpoint)
+    if output is None:
+        output = artifact_path(checkpoint, digest)
+
+        root, _ = os.path.splitext(checkpoint)
+        for v in glob.glob(f'{root}.*.torchscript.pt'):
+            if v != output:
+                os.remove(v)
+
+    model = XiheNet.load_from_checkpoint(checkpoint, map_location='cpu')
+    _ = model.eval()
+
+    for v in model.modules():
+        if neighbourhood_chunk is not None and hasattr(v, 'chunk'):
+            v.chunk = int(neighbourhood_chunk)
+
+    meta = {
+        'checkpoint': digest,
+        'model_version': model_version,
+        'min': torch.as_tensor(model.hparams['min']).tolist(),
+        'scale': torch.as_tensor(model.hparams['scale']).tolist(),
+        'fps_shortcut': any(
+            getattr(v, 'fps_shortcut', False) for v in model.modules()),
+        'neighbourhood_chunk': max(
+            getattr(v, 'chunk', 0) for v in model.modules()),
+        'torch': torch.__version__
+    }
+
+    # Script the plain torch FPS even with torch_cluster installed, its
+    # custom ops are only registered in processes importing it
+    from model import pointconv_util
+    fps = pointconv_util.farthest_point_sample
+    pointconv_util.farthest_point_sample = \
+        pointconv_util.farthest_point_sample_batched
+
+    try:
+        scripted = torch.jit.script(model)
+    finally:
+        pointconv_util.farthest_point_sample = fps
+
+    # workers of a pre-forked service may export concurrently
+    tmp = f'{output}.{os.getpid()}.tmp'
+    torch.jit.save(
+        scripted, tmp, _extra_files={'xihe.json': json.dumps(meta)})
+    os.replace(tmp, output)
+
+    print(f'TorchScript artifact saved to {output}')
+
+    return output
+
+
+class InferenceEngine:
+    """Scripted XiheNet model on a configurable device
+
+    Parameters
+    ----------
+    checkpoint : str
+        Path to the XiheNet checkpoint
+    artifact : str
+        TorchScript artifact to serve instead of exporting the
+        checkpoint, for deployments without the training modules
+    device : str
+        Torch device to run on, e.g. 'cuda', 'cuda:1' or 'cpu'
+    n_threads : int
+        Intra-op threads used on CPU, None to keep torch's default
+    warmup_anchor_sizes : list
+        Anchor sizes the model is warmed up for before serving
+    warmup_batch_sizes : list
+        Batch sizes the model is warmed up for before serving
+    warmup_repeat : int
+        Forward passes per warm-up shape; the TorchScript profiling
+        executor optimizes a graph after its first runs
+    """
+
+    def __init__(self, checkpoint='./model/model.ckpt', artifact=None,
+                 device='cuda', n_threads=None, warmup_anchor_sizes=(),
+                 warmup_batch_sizes=(1,), warmup_repeat=3):
+        self.checkpoint = checkpoint
+        self.artifact = artifact
+        self.device = torch.device(device)
+        self.n_threads = n_threads
+        self.warmup_anchor_sizes = warmup_anchor_sizes
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self.warmup_repeat = warmup_repeat
+
+        self.scripted_model = None
+        self.n_min = None
+        self.n_scale = None
+        self.model_version = 0
+        self.loader = None
+        self.ready = False
+        self.warmup_time = 0
+        self.warmup_failures = {}
+
+        self.latencies = collections.deque(maxlen=4096)
+
+    def configure(self, device=None, n_threads=None, artifact=None,
+                  warmup_anchor_sizes=None, warmup_batch_sizes=None):
+        if artifact is not None:
+            self.artifact = artifact
+
+        if warmup_anchor_sizes is not None:
+            self.warmup_anchor_sizes = sorted(set(warmup_anchor_sizes))
+
+        if warmup_batch_sizes is not None:
+            self.warmup_batch_sizes = sorted(set(warmup_batch_sizes))
+
+        if device is not None:
+            self.device = torch.device(device)
+
+        if n_threads is not None:
+            self.n_threads = max(1, int(n_threads))
+
+    def get_artifact(self):
+        """Path of the served artifact, exporting the checkpoint if needed"""
+        if self.artifact is not None:
+            return self.artifact
+
+        digest, _ = hash_checkpoint(self.checkpoint)
+        path = artifact_path(self.checkpoint, digest)
+
+        if not os.path.exists(path):
+            print(f'No TorchScript artifact of {self.checkpoint}, exporting')
+            export_model(self.checkpoint)
+
+        return path
+
+    def load(self):
+        if self.device.type == 'cuda' and not torch.cuda.is_available():
+            print('CUDA is not available, running inference on CPU')
+            self.device = torch.device('cpu')
+
+        if self.device.type == 'cpu' and self.n_threads is not None:
+            torch.set_num_threads(self.n_threads)
+
+        readiness.set('model', 'loading')
+        t0 = time.perf_counter()
+
+        path = self.get_artifact()
+
+        extra_files = {'xihe.json': ''}
+        model = torch.jit.load(
+            path, map_location=self.device, _extra_files=extra_files)
+        _ = model.eval()
+
+        meta = json.loads(extra_files['xihe.json'])
+        self.n_scale = torch.Tensor(meta['scale'])
+        self.n_min = torch.Tensor(meta['min'])
+        self.model_version = meta['model_version']
+
+        self.scripted_model = model
+        load_time = time.perf_counter() - t0
+
+        readiness.set('model', 'warming_up', load_time=load_time)
+        n_shapes = self.warm_up()
+
+        # handlers test `ready` from other threads, set last
+        self.ready = True
+
+        readiness.set(
+            'model', 'ready', device=str(self.device),
+            load_time=load_time, warmup_time=self.warmup_time,
+            warmup_shapes=n_shapes,
+            warmup_failures=sorted(self.warmup_failures))
+
+    def warm_up(self, anchor_sizes=None):
+        """Run the model on synthetic inputs of every serving shape
+
+        Profiling executor passes and allocator growth happen here
+        instead of on live traffic. `anchor_sizes` defaults to
+        `warmup_anchor_sizes`. A size that fails, e.g. by running out of
+        memory, is reported in `warmup_failures` and skipped instead of
+        failing the model. Return the number of shapes.
+        """
+        rng = np.random.RandomState(0)
+        t0 = time.perf_counter()
+        n_shapes = 0
+
+        if anchor_sizes is None:
+            anchor_sizes = self.warmup_anchor_sizes
+
+        for n in anchor_sizes:
+            try:
+                for b in self.warmup_batch_sizes:
+                    xyz = rng.normal(size=(b, 3, n)).astype(np.float32)
+                    rgb = rng.uniform(size=(b, 3, n)).astype(np.float32)
+
+                    for _ in range(self.warmup_repeat):
+                        self.infer(xyz, rgb, record=False)
+                    n_shapes += 1
+            except (RuntimeError, MemoryError) as e:
+                self.warmup_failures[n] = str(e)
+                print(f'Error, failed warming up XiheNet for {n} anchors: {e}')
+
+        t = time.perf_counter() - t0
+        self.warmup_time += t
+
+        if n_shapes > 0:
+            print(f'XiheNet warmed up for {n_shapes} shapes in {t:.2f}s')
+
+        return n_shapes
+
+    def load_background(self):
+        try:
+            self.load()
+        except Exception as e:
+            readiness.set('model', 'failed', error=str(e))
+            print(f'Error, failed loading XiheNet: {e}')
+            return
+
+        print(f'XiheNet loaded on {self.device}')
+
+    def start_loading(self):
+        """Load the model on a background thread, once"""
+        if self.loader is None:
+            readiness.set('model', 'loading')
+            self.loader = threading.Thread(
+                target=self.load_background, name='model-loader', daemon=True)
+            self.loader.start()
+
+    def stage(self, arr: np.ndarray) -> torch.Tensor:
+        """Move a [B, 3, N] input array to the model device"""
+        t = torch.from_numpy(np.ascontiguousarray(arr, dtype=np.float32))
+        return t.to(self.device)
+
+    def infer(self, xyz: np.ndarray, rgb: np.ndarray,
+              spans: Spans = None, record=True) -> np.ndarray:
+        """Estimate SH coefficients
+
+        Input:
+            xyz: point positions, [B, 3, N] or [3, N]
+            rgb: point colors, [B, 3, N] or [3, N]
+            spans: optional recorder of the 'stage', 'forward' and
+                'postprocess' spans
+            record: add the latency to the engine stats
+        Return:
+            coefficients: normalized SH coefficients, [B, 27] or [27]
+        """
+        single = xyz.ndim == 2
+        if single:
+            xyz, rgb = xyz[np.newaxis, ::], rgb[np.newaxis, ::]
+
+        t0 = time.perf_counter()
+
+        with inference_mode():
+            xyz, rgb = self.stage(xyz), self.stage(rgb)
+            t1 = time.perf_counter()
+
+            p = self.scripted_model.forward(xyz, rgb)
+            p = p.cpu()
+            t2 = time.perf_counter()
+
+        p = (p - self.n_min) / self.n_scale
+        p = p.numpy()
+
+        t3 = time.perf_counter()
+        if record:
+            self.latencies.append((len(p), t3 - t0))
+
+        if spans is not None:
+            spans.add('stage', t0, t1)
+            spans.add('forward', t1, t2)
+            spans.add('postprocess', t2, t3)
+
+        return p[0] if single else p
+
+    def report(self):
+        latencies = np.array(self.latencies, dtype=np.float64).reshape((-1, 2))
+        per_sample = latencies[:, 1] / np.maximum(latencies[:, 0], 1) * 1000
+        if len(per_sample) == 0:
+            per_sample = np.zeros((1), dtype=np.float64)
+
+        return {
+            'device': str(self.device),
+            'n_threads': torch.get_num_threads(),
+            'ready': self.ready,
+            'warmup_time': self.warmup_time,
+            'warmup_failures': {
+                str(k): v for k, v in self.warmup_failures.items()},
+            'n_forward': len(latencies),
+            'latency_per_sample_ms': {
+                'mean': float(per_sample.mean()),
+                'p50': float(np.percentile(per_sample, 50)),
+                'p99': float(np.percentile(per_sample, 99))
+            }
+        }
+
+
+engine = InferenceEngine()
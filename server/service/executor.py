@@ -0,0 +1,108 @@
+"""Bounded executors for blocking work
+
+Handlers must not block the Tornado IOLoop. Model inference runs on the
+inference executor, payload decoding and disk writes on the IO executor,
+so that a saturated model never stalls session, dump or health requests.
+"""
+
+import os
+import numpy as np
+
+from tornado.ioloop import IOLoop
+from concurrent.futures import ThreadPoolExecutor
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count() or 1))
+
+
+def pin_worker_cpus(task_id: int, n_workers: int):
+    """Pin a pre-forked worker to its own contiguous share of the CPUs"""
+    cpus = available_cpus()
+    if not hasattr(os, 'sched_setaffinity') or len(cpus) < n_workers:
+        return cpus
+
+    share = np.array_split(np.array(cpus), n_workers)[task_id]
+    os.sched_setaffinity(0, share.tolist())
+
+    return share.tolist()
+
+
+def torch_threads_per_worker(n_workers: int) -> int:
+    """Partition CPU cores among inference threads
+
+    Each executor thread gets its own share of intra-op threads so that
+    concurrent forward passes do not oversubscribe the cores.
+    """
+    return max(1, len(available_cpus()) // max(1, n_workers))
+
+
+class BoundedExecutor:
+    """Thread pool with a fixed number of threads
+
+    Parameters
+    ----------
+    name : str
+        Thread name prefix
+    n_threads : int
+        Number of worker threads
+    torch_threads : int
+        Intra-op torch threads for every worker, None to leave unchanged
+    """
+
+    def __init__(self, name, n_threads=1, torch_threads=None):
+        self.name = name
+        self.n_threads = n_threads
+        self.torch_threads = torch_threads
+        self.pool = None
+
+    def configure(self, n_threads=None, torch_threads=None):
+        if n_threads is not None:
+            self.n_threads = max(1, int(n_threads))
+
+        if torch_threads is not None:
+            self.torch_threads = max(1, int(torch_threads))
+
+        self.shutdown()
+
+    def get_pool(self) -> ThreadPoolExecutor:
+        if self.pool is None:
+            initializer, initargs = None, ()
+            if self.torch_threads is not None:
+                # deferred, routes without a model never import torch
+                import torch
+
+                torch.set_num_threads(self.torch_threads)
+                initializer, initargs = torch.set_num_threads, (self.torch_threads,)
+
+            self.pool = ThreadPoolExecutor(
+                max_workers=self.n_threads,
+                thread_name_prefix=self.name,
+                initializer=initializer,
+                initargs=initargs)
+
+        return self.pool
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` on the pool, returns an awaitable future"""
+        return IOLoop.current().run_in_executor(self.get_pool(), fn, *args)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+
+inference_executor = BoundedExecutor(
+    'inference', n_threads=2, torch_threads=torch_threads_per_worker(2))
+io_executor = BoundedExecutor('io', n_threads=4)
+
+
+def configure_executors(inference_threads=2, io_threads=4):
+    inference_executor.configure(
+        n_threads=inference_threads,
+        torch_threads=torch_threads_per_worker(inference_threads))
+    io_executor.configure(n_threads=io_threads)
@@ -0,0 +1,176 @@
+"""Temporal filtering of SH coefficients
+
+Smooths the per-frame network output of a session and predicts the
+coefficients of frames that are not inferred, either because their
+input barely changed or because the server is under load. Filter state
+lives in the session, keyed by 'filter', so it is local to one worker
+process and filtering is limited to single-worker deployments.
+
+Modes:
+- 'ema': exponential moving average, predictions hold the last estimate
+- 'kalman': constant-velocity Kalman filter on every coefficient,
+  predictions extrapolate the estimated trend
+"""
+
+import time
+
+import numpy as np
+
+
+class TemporalFilter:
+    """Per-session temporal filter over the 27 SH coefficients
+
+    Parameters
+    ----------
+    mode : str
+        Default filter mode, 'none', 'ema' or 'kalman'
+    alpha : float
+        Smoothing factor of the exponential moving average
+    process_noise : float
+        Kalman process noise of the coefficient velocity
+    measurement_noise : float
+        Kalman noise of a single network estimate
+    shed_load : int
+        Answer frames with predictions while this many inferences are
+        queued or running, 0 to always infer
+    """
+
+    modes = ('none', 'ema', 'kalman')
+
+    def __init__(self, mode='none', alpha=0.5, process_noise=1.0,
+                 measurement_noise=1e-2, shed_load=0):
+        self.mode = mode
+        self.alpha = alpha
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.shed_load = shed_load
+
+        # modes clients may select, 'none' only across worker processes
+        self.allowed_modes = self.modes
+
+        # time source of the filter, replaced by offline replays
+        self.clock = time.monotonic
+
+        self.n_filtered = 0
+        self.n_predicted = 0
+
+    def configure(self, mode=None, alpha=None, shed_load=None,
+                  allowed_modes=None):
+        if allowed_modes is not None:
+            self.allowed_modes = tuple(allowed_modes)
+        if mode is not None:
+            self.mode = self.get_mode(mode)
+        if alpha is not None:
+            self.alpha = float(alpha)
+        if shed_load is not None:
+            self.shed_load = int(shed_load)
+
+    def get_mode(self, mode=None):
+        """Resolve a requested mode, falling back to the default"""
+        mode = self.mode if mode is None else str(mode).lower()
+        if mode not in self.modes:
+            raise ValueError(f'Unknown SH filter mode {mode}')
+        if mode not in self.allowed_modes:
+            raise ValueError(
+                f'SH filter mode {mode} is not available with several '
+                f'worker processes')
+
+        return mode
+
+    def should_shed(self, session, in_flight, mode=None):
+        return self.shed_load > 0 and in_flight >= self.shed_load and \
+            self.get_state(session, mode) is not None
+
+    def get_state(self, session, mode=None):
+        """Filter state of a session if it was built by the given mode"""
+        mode = self.get_mode(mode)
+        state = session.get('filter')
+        if mode == 'none' or state is None or state['mode'] != mode:
+            return None
+
+        return state
+
+    def transition(self, dt):
+        F = np.array([[1, dt], [0, 1]], dtype=np.float64)
+        Q = self.process_noise * np.array([
+            [dt ** 3 / 3, dt ** 2 / 2],
+            [dt ** 2 / 2, dt]
+        ], dtype=np.float64)
+
+        return F, Q
+
+    def update(self, session: dict, coefficients: np.ndarray, mode=None):
+        """Fold a new network estimate into the session's filter state"""
+        mode = self.get_mode(mode)
+        if mode == 'none':
+            return coefficients
+
+        now = self.clock()
+        state = session.get('filter')
+
+        if state is None or state['mode'] != mode:
+            session['filter'] = {
+                'mode': mode,
+                't': now,
+                'x': coefficients.astype(np.float64),
+                'v': np.zeros_like(coefficients, dtype=np.float64),
+                'P': np.tile(np.eye(2) * self.measurement_noise,
+                             (len(coefficients), 1, 1))
+            }
+            return coefficients
+
+        self.n_filtered += 1
+
+        if mode == 'ema':
+            state['x'] = self.alpha * coefficients + \
+                (1 - self.alpha) * state['x']
+            state['t'] = now
+
+            return state['x'].astype(np.float32)
+
+        # Kalman predict
+        F, Q = self.transition(now - state['t'])
+        x = state['x'] + state['v'] * (now - state['t'])
+        v = state['v']
+        P = F @ state['P'] @ F.T + Q
+
+        # Kalman update, the network observes the coefficient only
+        S = P[:, 0, 0] + self.measurement_noise
+        K = P[:, :, 0] / S[:, np.newaxis]
+        y = coefficients - x
+
+        state['x'] = x + K[:, 0] * y
+        state['v'] = v + K[:, 1] * y
+        state['P'] = P - K[:, :, np.newaxis] * P[:, np.newaxis, 0, :]
+        state['t'] = now
+
+        return state['x'].astype(np.float32)
+
+    def predict(self, session: dict, mode=None):
+        """Predicted coefficients for the current time
+
+        None if the session has no state of the given filter mode, i.e.
+        requests without a filter are never answered with predictions.
+        """
+        state = self.get_state(session, mode)
+        if state is None:
+            return None
+
+        self.n_predicted += 1
+
+        if state['mode'] == 'ema':
+            return state['x'].astype(np.float32)
+
+        dt = self.clock() - state['t']
+        return (state['x'] + state['v'] * dt).astype(np.float32)
+
+    def report(self):
+        return {
+            'mode': self.mode,
+            'shed_load': self.shed_load,
+            'n_filtered': self.n_filtered,
+            'n_predicted': self.n_predicted
+        }
+
+
+sh_filter = TemporalFilter()
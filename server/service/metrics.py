@@ -0,0 +1,148 @@
+"""Service metrics
+
+Request counts, in-flight gauges and per-stage latency histograms of
+the lighting estimation pipeline, exposed in the Prometheus text format
+at `/api/v2/metrics`. Histograms have fixed buckets, so recording a
+sample is a dict lookup and a bisection. Metrics are recorded on the
+IOLoop thread; every pre-forked worker reports its own metrics.
+
+Stages of a lighting estimation request:
+- 'decode': payload decoding on the IO executor
+- 'queue': waiting for the batch to be executed
+- 'stage': moving the batched inputs to the model device
+- 'forward': the forward pass of the batch
+- 'postprocess': denormalization, triggering and temporal filtering
+- 'serialize': encoding the response
+"""
+
+import bisect
+import collections
+
+
+latency_buckets = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """Cumulative histogram with fixed upper bounds"""
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        n = 0
+        for le, count in zip((*self.buckets, float('inf')), self.counts):
+            n += count
+            yield le, n
+
+
+def format_labels(labels: dict) -> str:
+    return ','.join(f'{k}="{v}"' for k, v in labels.items())
+
+
+def format_value(v) -> str:
+    if v == float('inf'):
+        return '+Inf'
+
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Metrics:
+    """Registry of the service metrics"""
+
+    def __init__(self):
+        self.enabled = True
+
+        self.stages = collections.defaultdict(Histogram)
+        self.durations = collections.defaultdict(Histogram)
+        self.requests = collections.Counter()
+        self.in_flight = collections.Counter()
+        self.gauges = {}
+
+    def configure(self, enabled=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+
+    def register_gauge(self, name, description, fn):
+        """Report `fn()` as a gauge, evaluated when metrics are rendered"""
+        self.gauges[name] = (description, fn)
+
+    def start_request(self, endpoint):
+        self.in_flight[endpoint] += 1
+
+    def finish_request(self, endpoint, status, duration):
+        self.in_flight[endpoint] -= 1
+        self.requests[(endpoint, str(status))] += 1
+
+        if self.enabled:
+            self.durations[(endpoint,)].observe(duration)
+
+    def observe_stages(self, endpoint, anchor_size, durations: dict):
+        if not self.enabled:
+            return
+
+        for stage, v in durations.items():
+            self.stages[(endpoint, str(anchor_size), stage)].observe(v)
+
+    def render_histograms(self, name, description, histograms, label_names):
+        lines = [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+
+        for key in sorted(histograms):
+            h = histograms[key]
+            labels = format_labels(dict(zip(label_names, key)))
+
+            for le, n in h.cumulative():
+                lines.append(
+                    f'{name}_bucket{{{labels},le="{format_value(le)}"}} {n}')
+            lines.append(f'{name}_sum{{{labels}}} {format_value(h.sum)}')
+            lines.append(f'{name}_count{{{labels}}} {h.count}')
+
+        return lines
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = [
+            '# HELP xihe_requests_total Finished requests',
+            '# TYPE xihe_requests_total counter'
+        ]
+        for (endpoint, status), n in sorted(self.requests.items()):
+            labels = format_labels({'endpoint': endpoint, 'status': status})
+            lines.append(f'xihe_requests_total{{{labels}}} {n}')
+
+        lines += [
+            '# HELP xihe_requests_in_flight Requests being processed',
+            '# TYPE xihe_requests_in_flight gauge'
+        ]
+        for endpoint, n in sorted(self.in_flight.items()):
+            labels = format_labels({'endpoint': endpoint})
+            lines.append(f'xihe_requests_in_flight{{{labels}}} {n}')
+
+        lines += self.render_histograms(
+            'xihe_request_duration_seconds', 'Request duration',
+            self.durations, ('endpoint',))
+        lines += self.render_histograms(
+            'xihe_stage_duration_seconds',
+            'Lighting estimation stage duration per request',
+            self.stages,
+            ('endpoint', 'anchor_size', 'stage'))
+
+        for name, (description, fn) in sorted(self.gauges.items()):
+            lines += [
+                f'# HELP {name} {description}',
+                f'# TYPE {name} gauge',
+                f'{name} {format_value(fn())}'
+            ]
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -5,8 +5,8 @@ request payloads identified by request header. Mostly built
 for testing and debugging convince.
 """
 
+import collections
 import numpy as np
-from datetime import datetime
 
 from utils3d import fibonacci_sphere
 from utils3d import spherical_to_cartesian
@@ -79,11 +79,64 @@ def handle_point_cloud_xihe_optimized(payload, anchors):
     return pc
 
 
+# One packed point of a point_cloud_xihe_optimized payload, 7 bytes
+xihe_point_dtype = np.dtype([
+    ('index', '<u2'),
+    ('color', 'u1', (3,)),
+    ('distance', '<f2')
+])
+
+
+def handle_point_cloud_xihe_optimized_inplace(payload, anchors, out=None):
+    """Structured decoder for point_cloud_xihe_optimized payloads
+
+    Reads the payload in place through a packed structured dtype and
+    scatters the points into `out`, a preallocated channel-first
+    [6, N] float32 buffer, whose `out[:3]` and `out[3:]` rows are the
+    model-ready xyz and rgb inputs. Produces the same values as
+    `handle_point_cloud_xihe_optimized`, transposed.
+    """
+    points = np.frombuffer(payload, dtype=xihe_point_dtype)
+
+    if out is None:
+        out = np.empty((6, len(anchors)), dtype=np.float32)
+
+    out.fill(0)
+
+    index = points['index']
+    out[:3, index] = anchors[index].T * points['distance']
+    out[3:, index] = points['color'].T / np.float32(255)
+
+    return out
+
+
+class DecodeBufferPool:
+    """Reusable channel-first decode buffers keyed by anchor size
+
+    Buffers are handed out per frame and returned once the frame's
+    inputs have been copied into a batch, so steady-state decoding
+    does not allocate its output.
+    """
+
+    def __init__(self, max_free=64):
+        self.max_free = max_free
+        self.free = collections.defaultdict(list)
+
+    def acquire(self, n_anchors: int) -> np.ndarray:
+        free = self.free[n_anchors]
+        if len(free) > 0:
+            return free.pop()
+
+        return np.empty((6, n_anchors), dtype=np.float32)
+
+    def release(self, buf: np.ndarray):
+        free = self.free[buf.shape[1]]
+        if len(free) < self.max_free:
+            free.append(buf)
+
+
 def handle_client_log(payload: bytes):
-    str_datetime = f'{datetime.now():%Y-%m-%d-%H-%-M-%S%z}'
-    f = open(f'./dump/client_logs/{str_datetime}.txt', 'w')
-    f.write(payload.decode('utf-8'))
-    f.close()
+    return payload.decode('utf-8')
 
 
 def handle_point_cloud_spherical_coordinate(payload):
@@ -105,8 +158,7 @@ def handle_rgbd_ar_session(payload):
     pc = np.frombuffer(payload, dtype=np.float32)
     pc = pc.reshape((-1, 256 * 192, 6))
 
-    str_datetime = f'{datetime.now():%Y-%m-%d-%H-%-M-%S%z}'
-    np.save(f'./dump/rgbd_ar_session/{str_datetime}', pc)
+    return pc
 
 
 payload_processors = {
@@ -116,5 +168,6 @@ payload_processors = {
     'point_cloud_row_major': handle_point_cloud_row_major,
     'point_cloud_float4_no_stripe': handle_point_cloud_float4_no_stripe,
     'point_cloud_xihe_optimized': handle_point_cloud_xihe_optimized,
-    'point_cloud_spherical_coordinate': handle_point_cloud_spherical_coordinate
+    'point_cloud_spherical_coordinate': handle_point_cloud_spherical_coordinate,
+    'rgbd_ar_session': handle_rgbd_ar_session
 }
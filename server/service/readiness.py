@@ -0,0 +1,37 @@
+"""Service readiness
+
+Components that take long to start, such as the model behind the
+lighting estimation routes, report their state here instead of blocking
+`start_service`. Routes backed by a component that is not ready yet
+answer with a "warming up" status, and `/api/v2/health/` reports every
+component, so routes that need no model are served right away.
+"""
+
+import time
+
+
+class Readiness:
+    """States of the slow-starting components of a worker
+
+    States are 'cold' before loading starts, then 'loading', 'ready'
+    or 'failed'.
+    """
+
+    def __init__(self):
+        self.components = {}
+
+    def set(self, name, state, **info):
+        self.components[name] = {'state': state, 'since': time.time(), **info}
+
+    def state(self, name):
+        return self.components.get(name, {'state': 'cold'})['state']
+
+    @property
+    def ready(self):
+        return all(v['state'] == 'ready' for v in self.components.values())
+
+    def report(self):
+        return {'ready': self.ready, 'components': dict(self.components)}
+
+
+readiness = Readiness()
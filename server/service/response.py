@@ -0,0 +1,61 @@
+"""Binary SH coefficient responses
+
+Instead of JSON, clients may ask for SH coefficients as raw
+little-endian floats behind a fixed 8 byte header:
+
+    uint8   status
+    uint8   dtype, 0 for float32, 1 for float16
+    uint16  model version
+    uint32  sequence number
+
+All fields are little-endian. The format is negotiated with the Accept
+header of a request, or chosen once for a WebSocket stream.
+"""
+
+import struct
+
+import numpy as np
+
+
+header = struct.Struct('<BBHI')
+
+formats = {
+    'f32': {'code': 0, 'dtype': np.dtype('<f4'),
+            'media_type': 'application/x-xihe-sh-f32'},
+    'f16': {'code': 1, 'dtype': np.dtype('<f2'),
+            'media_type': 'application/x-xihe-sh-f16'}
+}
+
+
+def negotiate(accept, default='json'):
+    """Pick a response format from an Accept header
+
+    Returns 'json' unless one of the binary media types is accepted.
+    """
+    if not accept:
+        return default
+
+    for media_range in accept.split(','):
+        media_type = media_range.split(';')[0].strip().lower()
+
+        for fmt, v in formats.items():
+            if media_type == v['media_type']:
+                return fmt
+
+        if media_type in ('application/json', '*/*'):
+            return 'json'
+
+    return default
+
+
+def encode_coefficients(coefficients, fmt='f32', status=0, seq=0,
+                        model_version=0) -> bytes:
+    """Pack SH coefficients, None for a header-only reply"""
+    f = formats[fmt]
+    data = header.pack(status, f['code'], model_version & 0xFFFF,
+                       seq & 0xFFFFFFFF)
+
+    if coefficients is None:
+        return data
+
+    return data + np.asarray(coefficients).astype(f['dtype']).tobytes()
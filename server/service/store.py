@@ -0,0 +1,318 @@
+"""Session store
+
+Sessions are kept in a process-local LRU dict bounded by an idle TTL, a
+session capacity and a byte budget. For pre-forked serving, the store is
+switched to a shared table living in an anonymous mmap created before
+forking, so a session registered by one worker can be served by any
+other worker. Expired sessions are removed by a periodic sweep.
+"""
+
+import mmap
+import time
+import uuid
+import collections
+import multiprocessing
+
+import numpy as np
+
+
+class SessionNotFound(KeyError):
+    """Raised for unknown or evicted sessions, clients should re-register"""
+
+
+def session_nbytes(session: dict) -> int:
+    """Approximate memory held by a session
+
+    Anchor tables are shared by all sessions of the same anchor size and
+    therefore not accounted to individual sessions.
+    """
+    nbytes = 256
+    for k, v in session.items():
+        if k == 'anchors':
+            continue
+        if isinstance(v, np.ndarray):
+            nbytes += v.nbytes
+        elif isinstance(v, dict):
+            nbytes += session_nbytes(v)
+
+    return nbytes
+
+
+class SessionStore:
+    """Registry of AR sessions keyed by session ID
+
+    Parameters
+    ----------
+    anchor_fn : callable
+        Maps an anchor size to its anchor table, used to restore
+        sessions registered by another worker
+    ttl : float
+        Seconds of inactivity after which a session is evicted
+    capacity : int
+        Maximum number of sessions, least recently used are evicted first
+    max_bytes : int
+        Budget for the memory held by all sessions
+    """
+
+    slot_dtype = np.dtype([
+        ('sid', 'V16'),
+        ('last_access', '<f8'),
+        ('anchor_size', '<u4'),
+        ('used', 'u1')
+    ], align=True)
+
+    SLOT_EMPTY = 0
+    SLOT_USED = 1
+    SLOT_DELETED = 2
+
+    # slots tested per numpy step of a lookup
+    probe_window = 64
+    # share of tombstones in the table that triggers a rebuild
+    max_tombstones = 0.25
+
+    def __init__(self, anchor_fn, ttl=600, capacity=4096,
+                 max_bytes=256 * 1024 * 1024):
+        self.anchor_fn = anchor_fn
+        self.ttl = ttl
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+
+        self.sessions = collections.OrderedDict()
+        self.nbytes = 0
+        self.evictions = collections.Counter()
+
+        self.table = None
+        self.lock = None
+        self.compactions = 0
+
+    def configure(self, ttl=None, capacity=None, max_bytes=None):
+        if ttl is not None:
+            self.ttl = float(ttl)
+        if capacity is not None:
+            self.capacity = int(capacity)
+        if max_bytes is not None:
+            self.max_bytes = int(max_bytes)
+
+    @property
+    def shared(self):
+        return self.table is not None
+
+    def share(self, capacity=65536):
+        """Move the store into shared memory, call before forking"""
+        buf = mmap.mmap(-1, capacity * self.slot_dtype.itemsize)
+
+        self.table = np.frombuffer(buf, dtype=self.slot_dtype)
+        self.lock = multiprocessing.Lock()
+        self.capacity = min(self.capacity, capacity)
+
+        sessions, self.sessions = self.sessions, collections.OrderedDict()
+        for sid, session in sessions.items():
+            self.register(sid, session['anchors'])
+
+    def probe(self, sid: uuid.UUID):
+        """Yield windows of table slots for a session ID, linear probing"""
+        capacity = len(self.table)
+        start = int.from_bytes(sid.bytes[:8], 'little') % capacity
+        window = min(self.probe_window, capacity)
+
+        for offset in range(0, capacity, window):
+            n = min(window, capacity - offset)
+            yield (start + offset + np.arange(n)) % capacity
+
+    def lookup(self, sid: uuid.UUID):
+        """Find the slot of a session ID
+
+        Returns the slot holding the session, or None together with the
+        first free slot a new session could be inserted at. Slots are
+        tested a window at a time with numpy.
+        """
+        key = np.void(sid.bytes)
+        free = None
+
+        for slots in self.probe(sid):
+            states = self.table['used'][slots]
+
+            # the probe sequence ends at the first empty slot
+            empty = np.flatnonzero(states == self.SLOT_EMPTY)
+            end = empty[0] if len(empty) > 0 else len(slots)
+
+            hits = np.flatnonzero(
+                (states[:end] == self.SLOT_USED) &
+                (self.table['sid'][slots[:end]] == key))
+            if len(hits) > 0:
+                return int(slots[hits[0]]), None
+
+            if free is None:
+                deleted = np.flatnonzero(states[:end] == self.SLOT_DELETED)
+                if len(deleted) > 0:
+                    free = int(slots[deleted[0]])
+
+            if end < len(slots):
+                return None, int(slots[end]) if free is None else free
+
+        return None, free
+
+    def compact(self):
+        """Rebuild the shared table without tombstones, caller holds the lock
+
+        Evicted slots are marked deleted to keep probe sequences intact.
+        Once they make up `max_tombstones` of the table, live sessions
+        are re-inserted into a cleared table so misses stop early again.
+        """
+        tombstones = int((self.table['used'] == self.SLOT_DELETED).sum())
+        if tombstones < self.max_tombstones * len(self.table):
+            return
+
+        live = self.table[self.table['used'] == self.SLOT_USED].copy()
+        self.table['used'] = self.SLOT_EMPTY
+
+        for entry in live:
+            _, free = self.lookup(uuid.UUID(bytes=entry['sid'].tobytes()))
+            self.table[free] = entry
+
+        self.compactions += 1
+
+    def register(self, sid: uuid.UUID, anchors: np.ndarray) -> bool:
+        now = time.monotonic()
+
+        if self.shared:
+            with self.lock:
+                slot, free = self.lookup(sid)
+                if slot is not None:
+                    return False
+                if free is None or self.table_size() >= self.capacity:
+                    self.evict_shared(1, 'capacity')
+                    self.compact()
+                    slot, free = self.lookup(sid)
+
+                self.table[free] = (sid.bytes, now, len(anchors), self.SLOT_USED)
+
+        elif sid in self.sessions:
+            return False
+
+        self.insert(sid, len(anchors), anchors)
+        self.enforce_bounds()
+
+        return True
+
+    def insert(self, sid, anchor_size, anchors):
+        session = {
+            'anchor_size': anchor_size,
+            'anchors': anchors,
+            'last_access': time.monotonic()
+        }
+        session['nbytes'] = session_nbytes(session)
+
+        self.sessions[sid] = session
+        self.nbytes += session['nbytes']
+
+        return session
+
+    def remove(self, sid, reason):
+        """Drop a session from this process
+
+        In shared mode the local sessions are only a cache of the shared
+        table, evictions are then decided on the table itself.
+        """
+        session = self.sessions.pop(sid, None)
+        if session is None:
+            return
+
+        self.nbytes -= session['nbytes']
+        if not self.shared:
+            self.evictions[reason] += 1
+
+    def __getitem__(self, sid: uuid.UUID) -> dict:
+        now = time.monotonic()
+
+        if self.shared:
+            with self.lock:
+                slot, _ = self.lookup(sid)
+                if slot is not None:
+                    self.table['last_access'][slot] = now
+                    anchor_size = int(self.table['anchor_size'][slot])
+
+            if slot is None:
+                self.sessions.pop(sid, None)
+                raise SessionNotFound(sid)
+
+            if sid not in self.sessions:
+                self.insert(sid, anchor_size, self.anchor_fn(anchor_size))
+
+        elif sid not in self.sessions:
+            raise SessionNotFound(sid)
+
+        session = self.sessions[sid]
+        session['last_access'] = now
+        self.sessions.move_to_end(sid)
+
+        return session
+
+    def __contains__(self, sid: uuid.UUID) -> bool:
+        try:
+            self[sid]
+        except SessionNotFound:
+            return False
+
+        return True
+
+    def __len__(self):
+        if not self.shared:
+            return len(self.sessions)
+
+        return self.table_size()
+
+    def table_size(self):
+        return int((self.table['used'] == self.SLOT_USED).sum())
+
+    def evict_shared(self, n, reason):
+        """Drop the `n` least recently used sessions of the shared table"""
+        used = np.flatnonzero(self.table['used'] == self.SLOT_USED)
+        oldest = used[np.argsort(self.table['last_access'][used])[:n]]
+
+        self.table['used'][oldest] = self.SLOT_DELETED
+        self.evictions[reason] += len(oldest)
+
+    def enforce_bounds(self):
+        while len(self.sessions) > self.capacity:
+            self.remove(next(iter(self.sessions)), 'capacity')
+
+        while self.nbytes > self.max_bytes and len(self.sessions) > 0:
+            self.remove(next(iter(self.sessions)), 'bytes')
+
+    def sweep(self):
+        """Evict idle sessions and re-account memory, run periodically"""
+        deadline = time.monotonic() - self.ttl
+
+        if self.shared:
+            with self.lock:
+                expired = (self.table['used'] == self.SLOT_USED) & \
+                    (self.table['last_access'] < deadline)
+                self.table['used'][expired] = self.SLOT_DELETED
+                self.evictions['ttl'] += int(expired.sum())
+                self.compact()
+
+        for sid, session in list(self.sessions.items()):
+            if session['last_access'] >= deadline:
+                break
+
+            self.remove(sid, 'ttl')
+
+        self.nbytes = 0
+        for session in self.sessions.values():
+            session['nbytes'] = session_nbytes(session)
+            self.nbytes += session['nbytes']
+
+        self.enforce_bounds()
+
+    def report(self):
+        return {
+            'live_sessions': len(self),
+            'local_sessions': len(self.sessions),
+            'bytes_held': self.nbytes,
+            'evictions': dict(self.evictions),
+            'compactions': self.compactions,
+            'ttl': self.ttl,
+            'capacity': self.capacity,
+            'max_bytes': self.max_bytes
+        }
@@ -0,0 +1,88 @@
+"""Incremental request body decoding
+
+Large uploads are handled with Tornado's `stream_request_body`: chunks
+are decoded and written as they arrive instead of buffering the whole
+body, so a handler holds at most one partial frame in memory and the
+network receive overlaps with the disk writes.
+"""
+
+import os
+
+import numpy as np
+
+
+class FrameSink:
+    """Writes a stream of fixed-size frames into a memory-mapped .npy file
+
+    Parameters
+    ----------
+    path : str
+        Output .npy file
+    n_frames : int
+        Number of frames of the upload
+    frame_shape : tuple
+        Shape of a single frame
+    dtype : np.dtype
+        Element type of the frames
+    """
+
+    def __init__(self, path, n_frames, frame_shape, dtype=np.float32):
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.frame_bytes = int(np.prod(frame_shape)) * self.dtype.itemsize
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.out = np.lib.format.open_memmap(
+            path, mode='w+', dtype=self.dtype,
+            shape=(n_frames, *self.frame_shape))
+
+        self.partial = bytearray()
+        self.n_frames = 0
+
+    def store(self, data):
+        if self.n_frames >= len(self.out):
+            raise ValueError('Upload is longer than announced')
+
+        self.out[self.n_frames] = np.frombuffer(
+            data, dtype=self.dtype).reshape(self.frame_shape)
+        self.n_frames += 1
+
+    def write(self, chunk: bytes):
+        """Decode all frames completed by `chunk`"""
+        chunk = memoryview(chunk)
+
+        if len(self.partial) > 0:
+            n = min(self.frame_bytes - len(self.partial), len(chunk))
+            self.partial += chunk[:n]
+            chunk = chunk[n:]
+
+            if len(self.partial) < self.frame_bytes:
+                return
+
+            self.store(self.partial)
+            self.partial = bytearray()
+
+        n_full = len(chunk) // self.frame_bytes
+        for i in range(n_full):
+            self.store(chunk[i * self.frame_bytes:(i + 1) * self.frame_bytes])
+
+        self.partial += chunk[n_full * self.frame_bytes:]
+
+    def close(self):
+        """Flush the output, raises ValueError for incomplete uploads"""
+        self.out.flush()
+        complete = len(self.partial) == 0 and self.n_frames == len(self.out)
+        del self.out
+
+        if not complete:
+            raise ValueError(
+                f'Incomplete upload, {self.n_frames} frames received')
+
+    def discard(self):
+        if hasattr(self, 'out'):
+            del self.out
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
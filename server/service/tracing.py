@@ -0,0 +1,148 @@
+"""Request tracing
+
+Every request gets a trace ID, echoed in the `Trace-ID` response header,
+and records the intervals of its stages as spans. Finished traces are
+kept in a ring buffer when sampled, or when slower than `slow_ms`, and
+can be dumped as Chrome trace-event JSON from `/api/v2/debug/traces/`
+to be opened in chrome://tracing or Perfetto. Clients may pass their
+own `Trace-ID` and force sampling with `Trace-Sample: 1`.
+"""
+
+import os
+import time
+import uuid
+import random
+import threading
+import contextlib
+import collections
+
+
+class Spans:
+    """Stage intervals recorded with `time.perf_counter`"""
+
+    def __init__(self):
+        self.spans = []
+
+    def add(self, name, t0, t1):
+        self.spans.append((name, t0, t1, threading.current_thread().name))
+
+    def extend(self, other):
+        self.spans.extend(other.spans)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, t0, time.perf_counter())
+
+    def timed(self, name, fn, *args):
+        """Call `fn(*args)` within a span, usable on executor threads"""
+        with self.span(name):
+            return fn(*args)
+
+    def durations(self) -> dict:
+        """Total seconds spent per span name"""
+        d = collections.defaultdict(float)
+        for name, t0, t1, _ in self.spans:
+            d[name] += t1 - t0
+
+        return d
+
+
+class Trace(Spans):
+    """Spans of one request"""
+
+    def __init__(self, trace_id, name, sampled=False, t_start=None):
+        super().__init__()
+        self.trace_id = trace_id
+        self.name = name
+        self.sampled = sampled
+        self.t_start = time.perf_counter() if t_start is None else t_start
+        self.t_end = None
+        self.args = {}
+
+    @property
+    def duration(self):
+        return (self.t_end or time.perf_counter()) - self.t_start
+
+    def events(self, lane):
+        """Chrome trace complete events, nested in the trace's own lane"""
+        pid = os.getpid()
+        events = [{
+            'name': self.name, 'cat': 'request', 'ph': 'X',
+            'ts': self.t_start * 1e6, 'dur': self.duration * 1e6,
+            'pid': pid, 'tid': lane,
+            'args': {'trace_id': self.trace_id, **self.args}
+        }]
+
+        for name, t0, t1, thread in self.spans:
+            events.append({
+                'name': name, 'cat': 'stage', 'ph': 'X',
+                'ts': t0 * 1e6, 'dur': (t1 - t0) * 1e6,
+                'pid': pid, 'tid': lane,
+                'args': {'trace_id': self.trace_id, 'thread': thread}
+            })
+
+        return events
+
+
+class Tracer:
+    """Sampling tracer with a ring buffer of recent traces
+
+    Parameters
+    ----------
+    sample_rate : float
+        Share of requests whose trace is kept
+    slow_ms : float
+        Traces of requests slower than this are always kept, None to
+        keep sampled traces only
+    capacity : int
+        Number of recent traces kept
+    """
+
+    def __init__(self, sample_rate=0.01, slow_ms=100, capacity=256):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.traces = collections.deque(maxlen=capacity)
+
+    def configure(self, sample_rate=None, slow_ms=None, capacity=None):
+        if sample_rate is not None:
+            self.sample_rate = float(sample_rate)
+        if slow_ms is not None:
+            self.slow_ms = float(slow_ms)
+        if capacity is not None:
+            self.traces = collections.deque(self.traces, maxlen=int(capacity))
+
+    def start(self, name, trace_id=None, sample=False, t_start=None) -> Trace:
+        sampled = sample or random.random() < self.sample_rate
+
+        return Trace(
+            trace_id or uuid.uuid4().hex[:16], name,
+            sampled=sampled, t_start=t_start)
+
+    def finish(self, trace: Trace, **args):
+        trace.t_end = time.perf_counter()
+        trace.args.update(args)
+
+        slow = self.slow_ms is not None and \
+            trace.duration * 1000 >= self.slow_ms
+
+        if trace.sampled or slow:
+            self.traces.append(trace)
+
+    def export(self, min_ms=0, limit=None):
+        """Chrome trace-event JSON of the kept traces"""
+        traces = [v for v in self.traces if v.duration * 1000 >= min_ms]
+        if limit is not None:
+            traces = traces[-int(limit):]
+
+        events = []
+        for lane, trace in enumerate(traces):
+            events.extend(trace.events(lane))
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+tracer = Tracer()
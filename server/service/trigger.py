@@ -0,0 +1,163 @@
+"""Server-side adaptive triggering
+
+Skips inference for frames whose point cloud barely changed since the
+last inferred frame of the same session, and answers them with the
+cached coefficients instead. A frame triggers a new inference when
+
+- the spherical entropy of its observed anchors, measured on coarser
+  fibonacci anchor levels as in `JointEntropyCalculator`, changed;
+- the colors of anchors observed in both frames changed;
+- the distances of anchors observed in both frames changed;
+- or the session skipped `max_skips` frames in a row.
+"""
+
+import numpy as np
+
+from service.utils import register_anchor_size
+
+
+class ChangeTrigger:
+    """Per-session change detector over decoded anchor point clouds
+
+    Parameters
+    ----------
+    threshold : float
+        Mean absolute color change ([0, 1] colors) and mean relative
+        distance change above which a frame is inferred
+    entropy_threshold : float
+        Joint spherical entropy change in bits above which a frame is
+        inferred
+    max_skips : int
+        Maximum number of consecutive frames answered from cache
+    anchor_levels : list
+        Coarse anchor sizes used for the spherical entropy
+    """
+
+    def __init__(self, threshold=0.02, entropy_threshold=0.05,
+                 max_skips=30, anchor_levels=(64, 256)):
+        self.enabled = False
+        self.threshold = threshold
+        self.entropy_threshold = entropy_threshold
+        self.max_skips = max_skips
+        self.anchor_levels = anchor_levels
+
+        self.level_index = {}
+
+        self.n_frames = 0
+        self.n_skipped = 0
+        self.t_inference = 0
+        self.t_saved = 0
+
+    def configure(self, enabled=None, threshold=None, max_skips=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if threshold is not None:
+            self.threshold = float(threshold)
+        if max_skips is not None:
+            self.max_skips = int(max_skips)
+
+    def get_level_index(self, anchors: np.ndarray):
+        """Nearest coarse anchor of every anchor, per anchor level"""
+        n = len(anchors)
+
+        if n not in self.level_index:
+            self.level_index[n] = [
+                np.argmax(anchors @ register_anchor_size(v).T, axis=-1)
+                for v in self.anchor_levels]
+
+        return self.level_index[n]
+
+    def spherical_entropy(self, anchors, observed):
+        entropy = 0
+
+        for level, index in zip(self.anchor_levels, self.get_level_index(anchors)):
+            counts = np.bincount(index[observed], minlength=level)
+            counts = counts[counts > 0]
+            if len(counts) == 0:
+                continue
+
+            p = counts / counts.sum()
+            entropy += -1 * np.sum(p * np.log2(p))
+
+        return float(entropy)
+
+    def summarize(self, pc: np.ndarray, anchors: np.ndarray) -> dict:
+        distances = np.linalg.norm(pc[:, :3], axis=-1)
+        observed = distances > 0
+
+        return {
+            'colors': pc[:, 3:].copy(),
+            'distances': distances,
+            'observed': observed,
+            'entropy': self.spherical_entropy(anchors, observed)
+        }
+
+    def should_infer(self, state: dict, frame: dict) -> bool:
+        if 'coefficients' not in state:
+            return True
+
+        if state['skips'] >= self.max_skips:
+            return True
+
+        if abs(frame['entropy'] - state['entropy']) > self.entropy_threshold:
+            return True
+
+        both = frame['observed'] & state['observed']
+        if not np.any(both):
+            return True
+
+        d_color = np.abs(frame['colors'][both] - state['colors'][both]).mean()
+        if d_color > self.threshold:
+            return True
+
+        d_distance = np.abs(
+            frame['distances'][both] - state['distances'][both]) / \
+            state['distances'][both]
+        if d_distance.mean() > self.threshold:
+            return True
+
+        return False
+
+    def check(self, session: dict, pc: np.ndarray):
+        """Test a decoded frame against the session's last inferred frame
+
+        Returns the frame summary and the cached coefficients, which are
+        None if the frame has to be inferred.
+        """
+        state = session.setdefault('trigger', {})
+        frame = self.summarize(pc, session['anchors'])
+
+        self.n_frames += 1
+
+        if self.should_infer(state, frame):
+            return frame, None
+
+        state['skips'] += 1
+        self.n_skipped += 1
+        self.t_saved += state['t_inference']
+
+        return frame, state['coefficients']
+
+    def update(self, session: dict, frame: dict, coefficients, t_inference):
+        state = session.setdefault('trigger', {})
+        state.update(frame)
+        state['coefficients'] = coefficients
+        state['skips'] = 0
+        state['t_inference'] = t_inference
+
+        self.t_inference += t_inference
+
+    def report(self):
+        n_inferred = self.n_frames - self.n_skipped
+
+        return {
+            'enabled': self.enabled,
+            'n_frames': self.n_frames,
+            'n_skipped': self.n_skipped,
+            'skip_rate': self.n_skipped / self.n_frames if self.n_frames else 0,
+            'mean_inference_ms': self.t_inference / n_inferred * 1000 if n_inferred else 0,
+            'saved_inference_s': self.t_saved
+        }
+
+
+trigger = ChangeTrigger()
@@ -1,16 +1,43 @@
+import time
 import uuid
 import json
 import tornado.web
 import numpy as np
 from urllib.parse import unquote
 
-from utils3d import fibonacci_sphere
+from utils3d.geometry import AnchorTableCache
+from service.store import SessionStore
+from service.metrics import metrics
+from service.tracing import tracer
 
 
 class BaseHttpRouter(tornado.web.RequestHandler):
+    trace = None
+
     def set_default_headers(self):
         self.set_header('Content-Type', 'application/json')
 
+        if self.trace is not None:
+            self.set_header('Trace-ID', self.trace.trace_id)
+
+    def prepare(self):
+        # The trace starts when Tornado started reading the request
+        self.trace = tracer.start(
+            self.request.path,
+            trace_id=self.request.headers.get('Trace-ID', '')[:64],
+            sample=self.request.headers.get('Trace-Sample') == '1',
+            t_start=time.perf_counter() - self.request.request_time())
+        self.set_header('Trace-ID', self.trace.trace_id)
+
+        metrics.start_request(self.request.path)
+
+    def on_finish(self):
+        if self.trace is not None:
+            metrics.finish_request(
+                self.request.path, self.get_status(),
+                self.request.request_time())
+            tracer.finish(self.trace, status=self.get_status())
+
     def get_body_json(self):
         body = self.request.body.decode('utf-8')
         body = json.loads(unquote(body))
@@ -19,31 +46,83 @@ class BaseHttpRouter(tornado.web.RequestHandler):
     def json(self, data):
         self.write(json.dumps(data))
 
+    def get_session(self):
+        """Session of the request's Session-ID header
+
+        Unknown and evicted sessions finish the request with a 404 that
+        asks the client to register a new session.
+        """
+        try:
+            sid = uuid.UUID(str(self.request.headers['Session-ID']))
+            return sid, session_pool[sid]
+        except (KeyError, ValueError):
+            self.set_status(404)
+            self.json({
+                'ok': False,
+                'error': 'session not found',
+                'reregister': True
+            })
+            raise tornado.web.Finish()
+
+
+# Anchor tables are built on first use, the common sizes are prefetched
+# off the request path when the service starts
+anchor_sizes = (2048, 1280, 1024, 768, 512)
+anchor_pool = AnchorTableCache(capacity=16)
+
+# Anchor sizes clients may use, every size gets a table in the anchor
+# cache, see `configure_anchor_sizes`
+session_anchor_sizes = list(anchor_sizes)
+
+
+def configure_anchor_sizes(sizes=None):
+    """Set the anchor sizes clients may use, returns them"""
+    global session_anchor_sizes
 
-anchor_pool = {}
+    if sizes is None:
+        sizes = anchor_sizes
+    elif isinstance(sizes, int):
+        sizes = [sizes]
 
-anchor_pool[2048] = fibonacci_sphere(2048)
-anchor_pool[1280] = fibonacci_sphere(1280)
-anchor_pool[1024] = fibonacci_sphere(1024)
-anchor_pool[768] = fibonacci_sphere(768)
-anchor_pool[512] = fibonacci_sphere(512)
+    sizes = sorted({int(v) for v in sizes}, reverse=True)
+    for v in sizes:
+        if not 0 < v <= anchor_pool.max_samples:
+            raise ValueError(f'Invalid anchor size {v}')
 
+    session_anchor_sizes = sizes
 
-session_pool = {}
+    return sizes
+
+
+def get_anchor_size(value) -> int:
+    """Anchor size of a client header, ValueError unless it is served"""
+    try:
+        anchor_size = int(value)
+    except (TypeError, ValueError):
+        anchor_size = None
+
+    if anchor_size not in session_anchor_sizes:
+        raise ValueError(
+            f'Anchor-Size must be one of {session_anchor_sizes}, got {value!r}')
+
+    return anchor_size
 
 
 def register_session(sid: uuid.UUID, anchors: np.ndarray):
-    if sid not in session_pool:
-        session_pool[sid] = {
-            'anchors': anchors,
-            'point_clouds': []
-        }
-    else:
+    if not session_pool.register(sid, anchors):
         print('Error, SID conflict')
 
 
 def register_anchor_size(samples: int):
-    if samples not in anchor_pool:
-        anchor_pool[samples] = fibonacci_sphere(samples)
-
     return anchor_pool[samples]
+
+
+def prefetch_anchor_sizes(sizes=None):
+    for v in session_anchor_sizes if sizes is None else sizes:
+        anchor_pool[v]
+
+
+session_pool = SessionStore(register_anchor_size)
+
+metrics.register_gauge(
+    'xihe_sessions', 'Live sessions', lambda: len(session_pool))
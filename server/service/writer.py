@@ -0,0 +1,177 @@
+"""Write-behind queue
+
+Dumps are encoded into container records by the request handlers and
+handed to a single background writer thread, which appends everything
+queued for the same container with one write. The queue is bounded by
+records and bytes; when it is full, `put` refuses the record so the
+handler can answer with 503 instead of stalling the service.
+"""
+
+import queue
+import atexit
+import threading
+import collections
+
+from service.container import RollingContainer
+
+
+class WriteBehindQueue:
+    """Bounded queue of container records drained by a writer thread
+
+    Parameters
+    ----------
+    root : str
+        Directory of the containers
+    max_records : int
+        Maximum number of queued records
+    max_bytes : int
+        Maximum size of all queued records
+    max_batch : int
+        Maximum number of records taken per drain
+    container_bytes : int
+        Size after which a container rolls over to a new part
+    max_open : int
+        Maximum number of container files kept open
+    compress : bool
+        Compress the records handlers encode for this queue, see
+        `service.container.encode_record`
+    """
+
+    def __init__(self, root='./dist/xihe_service', max_records=1024,
+                 max_bytes=256 * 1024 * 1024, max_batch=256,
+                 container_bytes=256 * 1024 * 1024, max_open=64,
+                 compress=False):
+        self.root = root
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_batch = max_batch
+        self.container_bytes = container_bytes
+        self.max_open = max_open
+        self.compress = compress
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending_bytes = 0
+
+        self.containers = collections.OrderedDict()
+        self.thread = None
+
+        self.n_written = 0
+        self.n_rejected = 0
+        self.n_writes = 0
+        self.n_errors = 0
+
+    def configure(self, root=None, max_records=None, max_bytes=None,
+                  compress=None):
+        if root is not None:
+            self.root = root
+        if max_records is not None:
+            self.max_records = int(max_records)
+        if max_bytes is not None:
+            self.max_bytes = int(max_bytes)
+        if compress is not None:
+            self.compress = bool(compress)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name='writer', daemon=True)
+            self.thread.start()
+
+    def put(self, name: str, record: bytes) -> bool:
+        """Queue a record for container `name`, False when full"""
+        with self.lock:
+            if self.queue.qsize() >= self.max_records or \
+                    self.pending_bytes + len(record) > self.max_bytes:
+                self.n_rejected += 1
+                return False
+
+            self.pending_bytes += len(record)
+
+        self.start()
+        self.queue.put((name, record))
+
+        return True
+
+    def get_container(self, name) -> RollingContainer:
+        if name in self.containers:
+            self.containers.move_to_end(name)
+            return self.containers[name]
+
+        container = RollingContainer(
+            self.root, name, max_bytes=self.container_bytes)
+        self.containers[name] = container
+
+        while len(self.containers) > self.max_open:
+            _, v = self.containers.popitem(last=False)
+            v.close()
+
+        return container
+
+    def drain(self, batch):
+        groups = collections.defaultdict(list)
+        for name, record in batch:
+            groups[name].append(record)
+
+        for name, records in groups.items():
+            try:
+                self.get_container(name).append(records)
+                self.n_written += len(records)
+                self.n_writes += 1
+            except OSError as e:
+                self.n_errors += len(records)
+                print(f'Error, failed writing {len(records)} records to {name}: {e}')
+
+        with self.lock:
+            self.pending_bytes -= sum(len(v[1]) for v in batch)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+
+            self.drain(batch)
+
+    def close(self):
+        """Write all queued records and close the containers"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+        for v in self.containers.values():
+            v.close()
+        self.containers.clear()
+
+    def report(self):
+        return {
+            'queued_records': self.queue.qsize(),
+            'queued_bytes': self.pending_bytes,
+            'max_records': self.max_records,
+            'max_bytes': self.max_bytes,
+            'n_written': self.n_written,
+            'n_writes': self.n_writes,
+            'n_rejected': self.n_rejected,
+            'n_errors': self.n_errors
+        }
+
+
+dump_writer = WriteBehindQueue()
+atexit.register(dump_writer.close)
+
+# one container per recording archive, rolled over at 4 GB only
+recording_writer = WriteBehindQueue(
+    root='./dist/recording', container_bytes=4 * 1024 ** 3)
+atexit.register(recording_writer.close)
@@ -0,0 +1,69 @@
+"""Parity of the in-place xihe_optimized decoder with the original"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from service.payload import xihe_point_dtype
+from service.payload import handle_point_cloud_xihe_optimized
+from service.payload import handle_point_cloud_xihe_optimized_inplace
+from utils3d import fibonacci_sphere
+
+
+def make_payload(rng, n_anchors, n_points, replace=False):
+    points = np.zeros(n_points, dtype=xihe_point_dtype)
+    points['index'] = rng.choice(n_anchors, n_points, replace=replace)
+    points['color'] = rng.randint(0, 256, (n_points, 3))
+    points['distance'] = rng.uniform(0, 5, n_points)
+
+    return points.tobytes()
+
+
+class XiheOptimizedDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def assert_parity(self, payload, anchors, out=None):
+        expected = handle_point_cloud_xihe_optimized(payload, anchors)
+        actual = handle_point_cloud_xihe_optimized_inplace(
+            payload, anchors, out)
+
+        self.assertEqual(actual.shape, (6, len(anchors)))
+        self.assertEqual(actual.dtype, np.float32)
+        np.testing.assert_array_equal(actual, expected.T)
+
+    def test_sparsity(self):
+        for n_anchors in (512, 768, 1024, 1280, 2048):
+            anchors = fibonacci_sphere(n_anchors)
+            for n_points in (0, 1, n_anchors // 4, n_anchors // 2, n_anchors):
+                with self.subTest(n_anchors=n_anchors, n_points=n_points):
+                    self.assert_parity(
+                        make_payload(self.rng, n_anchors, n_points), anchors)
+
+    def test_duplicate_indices(self):
+        # the last point of a repeated index wins in both decoders
+        anchors = fibonacci_sphere(1280)
+        self.assert_parity(
+            make_payload(self.rng, 1280, 2000, replace=True), anchors)
+
+    def test_memoryview(self):
+        # the WebSocket channel passes frames as memoryviews
+        anchors = fibonacci_sphere(1280)
+        payload = make_payload(self.rng, 1280, 640)
+        self.assert_parity(memoryview(payload), anchors)
+
+    def test_reused_buffer(self):
+        anchors = fibonacci_sphere(1024)
+        out = np.full((6, 1024), np.nan, dtype=np.float32)
+
+        for _ in range(3):
+            self.assert_parity(
+                make_payload(self.rng, 1024, 300), anchors, out)
+
+
+if __name__ == '__main__':
+    unittest.main()
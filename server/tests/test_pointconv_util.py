@@ -0,0 +1,161 @@
+"""Parity of the optimised PointConv utilities with the originals"""
+
+import os
+import sys
+import types
+import unittest
+import importlib.util
+
+import torch
+
+
+def load_pointconv_util():
+    # model/__init__.py imports the training stack, load the module alone
+    root = os.path.join(os.path.dirname(__file__), '..', 'model')
+    package = types.ModuleType('model')
+    package.__path__ = [root]
+    sys.modules.setdefault('model', package)
+
+    spec = importlib.util.spec_from_file_location(
+        'model.pointconv_util', os.path.join(root, 'pointconv_util.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+pointconv_util = load_pointconv_util()
+
+# (B, N, npoint), including sampling every point and a single point
+shapes = [(1, 100, 10), (4, 1280, 256), (3, 512, 512), (2, 7, 7), (5, 64, 1)]
+
+
+class FarthestPointSampleTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def assert_parity(self, fn, xyz, npoint):
+        expected = pointconv_util.farthest_point_sample_original(xyz, npoint)
+        actual = fn(xyz, npoint)
+
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertEqual(actual.dtype, torch.long)
+        self.assertTrue(torch.equal(actual, expected))
+
+    def test_batched(self):
+        for B, N, npoint in shapes:
+            with self.subTest(B=B, N=N, npoint=npoint):
+                self.assert_parity(
+                    pointconv_util.farthest_point_sample_batched,
+                    torch.rand(B, N, 3), npoint)
+
+    def test_batched_duplicate_points(self):
+        # ties between equally far points resolve to the lowest index
+        xyz = torch.rand(3, 32, 3).repeat(1, 4, 1)
+        for npoint in (16, 64, 128):
+            with self.subTest(npoint=npoint):
+                self.assert_parity(
+                    pointconv_util.farthest_point_sample_batched, xyz, npoint)
+
+    def test_batched_scripted(self):
+        fn = torch.jit.script(pointconv_util.farthest_point_sample_batched)
+        self.assert_parity(fn, torch.rand(4, 1280, 3), 256)
+
+    @unittest.skipIf(pointconv_util.fps is None, 'torch_cluster is not installed')
+    def test_cluster(self):
+        for B, N, npoint in shapes:
+            with self.subTest(B=B, N=N, npoint=npoint):
+                self.assert_parity(
+                    pointconv_util.farthest_point_sample_cluster,
+                    torch.rand(B, N, 3), npoint)
+
+
+class DensityAndKnnTest(unittest.TestCase):
+    B, N, nsample, bandwidth = 3, 700, 32, 0.1
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.xyz = torch.rand(self.B, self.N, 3)
+
+    def reference(self, knn_density=False):
+        xyz = self.xyz
+        knn_idx = pointconv_util.knn_point(self.nsample, xyz, xyz)
+
+        if not knn_density:
+            return pointconv_util.compute_density(xyz, self.bandwidth), knn_idx
+
+        sqrdists = pointconv_util.square_distance(xyz, xyz)
+        knn_dist = torch.gather(sqrdists, -1, knn_idx)
+        density = torch.exp(- knn_dist / (2.0 * self.bandwidth ** 2)).sum(-1)
+
+        return density / (self.N * 2.5 * self.bandwidth), knn_idx
+
+    def assert_density(self, actual, expected):
+        # tiles sum the Gaussian kernel in a different order
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertTrue(torch.allclose(actual, expected, rtol=1e-6, atol=0))
+
+    def assert_same_neighbours(self, actual, expected):
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertTrue(torch.equal(
+            torch.sort(actual, -1)[0], torch.sort(expected, -1)[0]))
+
+    def test_full_matrix(self):
+        density, knn_idx = pointconv_util.density_and_knn(
+            self.xyz, self.nsample, self.bandwidth)
+        expected_density, expected_idx = self.reference()
+
+        self.assertTrue(torch.equal(density, expected_density))
+        self.assertTrue(torch.equal(knn_idx, expected_idx))
+
+    def test_tiled(self):
+        # 64 does not divide N, 100 does, 16 is smaller than nsample
+        expected_density, expected_idx = self.reference()
+
+        for chunk in (16, 64, 100, 350, self.N):
+            with self.subTest(chunk=chunk):
+                density, knn_idx = pointconv_util.density_and_knn(
+                    self.xyz, self.nsample, self.bandwidth, chunk)
+
+                self.assert_density(density, expected_density)
+                self.assert_same_neighbours(knn_idx, expected_idx)
+
+    def test_density_only(self):
+        expected_density, _ = self.reference()
+
+        for chunk in (0, 64):
+            with self.subTest(chunk=chunk):
+                density, knn_idx = pointconv_util.density_and_knn(
+                    self.xyz, 0, self.bandwidth, chunk)
+
+                self.assert_density(density, expected_density)
+                self.assertEqual(knn_idx.shape, (self.B, self.N, 0))
+
+    def test_knn_density(self):
+        expected_density, expected_idx = self.reference(knn_density=True)
+
+        for chunk in (0, 16, 64, 100):
+            with self.subTest(chunk=chunk):
+                density, knn_idx = pointconv_util.density_and_knn(
+                    self.xyz, self.nsample, self.bandwidth, chunk, True)
+
+                self.assert_density(density, expected_density)
+                self.assert_same_neighbours(knn_idx, expected_idx)
+
+    def test_scripted(self):
+        fn = torch.jit.script(pointconv_util.density_and_knn)
+
+        for chunk in (0, 64):
+            with self.subTest(chunk=chunk):
+                density, knn_idx = fn(
+                    self.xyz, self.nsample, self.bandwidth, chunk, False)
+                expected_density, expected_idx = \
+                    pointconv_util.density_and_knn(
+                        self.xyz, self.nsample, self.bandwidth, chunk)
+
+                self.assertTrue(torch.equal(density, expected_density))
+                self.assertTrue(torch.equal(knn_idx, expected_idx))
+
+
+if __name__ == '__main__':
+    unittest.main()
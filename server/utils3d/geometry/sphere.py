@@ -1,21 +1,127 @@
+import os
 import math
+import threading
+import collections
 import numpy as np
 
 
 def fibonacci_sphere(samples=1):
+    """Evenly distributed points on the unit sphere
 
-    points = np.zeros((samples, 3), dtype=np.float32)
+    Input:
+        samples: number of points
+    Return:
+        points: unit vectors ordered from y = 1 to y = -1, [samples, 3]
+    """
+    i = np.arange(samples, dtype=np.float64)
     phi = math.pi * (3. - math.sqrt(5.))  # golden angle in radians
 
-    for i in range(samples):
-        y = 1 - (i / float(samples - 1)) * 2  # y goes from 1 to -1
-        radius = math.sqrt(1 - y * y)  # radius at y
+    y = 1 - (i / max(samples - 1, 1)) * 2  # y goes from 1 to -1
+    radius = np.sqrt(1 - y * y)  # radius at y
 
-        theta = phi * i  # golden angle increment
+    theta = phi * i  # golden angle increment
 
-        x = math.cos(theta) * radius
-        z = math.sin(theta) * radius
-
-        points[i] = [x, y, z]
+    points = np.empty((samples, 3), dtype=np.float32)
+    points[:, 0] = np.cos(theta) * radius
+    points[:, 1] = y
+    points[:, 2] = np.sin(theta) * radius
 
     return points
+
+
+class AnchorTableCache:
+    """LRU cache of fibonacci sphere anchor tables keyed by sample count
+
+    With a cache directory, tables are also stored as `.npy` files and
+    memory-mapped read-only on a miss, so processes share the pages of
+    the same table instead of recomputing it.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of tables held in process
+    cache_dir : str
+        Directory of the `.npy` tables, None to keep tables in memory only
+    max_samples : int
+        Largest table built, payloads index anchors with 16 bits
+    """
+
+    def __init__(self, capacity=16, cache_dir=None, max_samples=65536):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.max_samples = max_samples
+
+        self.tables = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def configure(self, capacity=None, cache_dir=None):
+        if capacity is not None:
+            self.capacity = max(1, int(capacity))
+        if cache_dir is not None:
+            self.cache_dir = cache_dir
+
+    def get_path(self, samples):
+        return os.path.join(self.cache_dir, f'fibonacci_sphere_{samples}.npy')
+
+    def load(self, samples):
+        """Memory-map a stored table, None if missing or malformed"""
+        path = self.get_path(samples)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            table = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+        if table.shape != (samples, 3) or table.dtype != np.float32:
+            return None
+
+        return table
+
+    def store(self, samples, table):
+        """Write a table atomically, concurrent writers may race"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        path = self.get_path(samples)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, table)
+        os.replace(tmp_path, path)
+
+    def __getitem__(self, samples) -> np.ndarray:
+        samples = int(samples)
+        if not 0 < samples <= self.max_samples:
+            raise ValueError(
+                f'Anchor size must be in [1, {self.max_samples}], got {samples}')
+
+        with self.lock:
+            if samples in self.tables:
+                self.tables.move_to_end(samples)
+                return self.tables[samples]
+
+        table = None
+        if self.cache_dir is not None:
+            table = self.load(samples)
+
+        if table is None:
+            table = fibonacci_sphere(samples)
+            table.flags.writeable = False
+
+            if self.cache_dir is not None:
+                self.store(samples, table)
+
+        with self.lock:
+            table = self.tables.setdefault(samples, table)
+            self.tables.move_to_end(samples)
+
+            while len(self.tables) > self.capacity:
+                self.tables.popitem(last=False)
+
+        return table
+
+    def __contains__(self, samples):
+        return int(samples) in self.tables
+
+    def __len__(self):
+        return len(self.tables)